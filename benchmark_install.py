@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Script to compare the extraction wall time of the decompression backends
+on tar.bz2 builds. Without builds a random archive is generated."""
+
+from optparse import OptionParser
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+
+from libs import install
+
+
+def generate_archive(filename, size):
+    """Write a tar.bz2 archive with a top-level folder and the given number
+       of megabytes of poorly compressible content"""
+
+    folder = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(folder, 'firefox'))
+        for index in range(size):
+            f = open(os.path.join(folder, 'firefox', 'file%d' % index), 'wb')
+            try:
+                f.write(os.urandom(512 * 1024).encode('base64'))
+            finally:
+                f.close()
+
+        archive = tarfile.open(filename, 'w:bz2')
+        try:
+            archive.add(os.path.join(folder, 'firefox'), 'firefox')
+        finally:
+            archive.close()
+    finally:
+        shutil.rmtree(folder)
+
+
+def list_tree(folder):
+    """Return the relative paths and sizes of all files of the folder"""
+
+    files = [ ]
+    for (root, folders, filenames) in os.walk(folder):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            files.append((os.path.relpath(path, folder),
+                          os.path.getsize(path)))
+    return sorted(files)
+
+
+def main():
+    usage = 'usage: %prog [options] [build.tar.bz2 ...]'
+    parser = OptionParser(usage=usage, description=__doc__)
+    parser.add_option('--processes',
+                      dest='processes',
+                      default=None,
+                      type='int',
+                      metavar='PROCESSES',
+                      help='Number of processes of the blocks backend, '
+                           'default: number of CPUs')
+    parser.add_option('--repeat', '-r',
+                      dest='repeat',
+                      default=3,
+                      type='int',
+                      metavar='REPEAT',
+                      help='Number of times each build is extracted, default: 3')
+    parser.add_option('--size',
+                      dest='size',
+                      default=40,
+                      type='int',
+                      metavar='MEGABYTES',
+                      help='Uncompressed size of the generated archive, '
+                           'default: 40')
+    (options, args) = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        if not args:
+            filename = os.path.join(work_dir, 'generated.tar.bz2')
+            generate_archive(filename, options.size)
+            args.append(filename)
+
+        for filename in args:
+            print '%s (%d bytes):' % (filename, os.path.getsize(filename))
+
+            results = { }
+            for backend_class in install.DECOMPRESSION_BACKENDS:
+                backend = backend_class()
+                if not backend.available():
+                    print '  %-8s not available' % backend.name
+                    continue
+                if backend.name == 'blocks' and options.processes:
+                    backend.processes = options.processes
+
+                duration = 0
+                for i in range(options.repeat):
+                    destination = os.path.join(work_dir, backend.name)
+                    shutil.rmtree(destination, True)
+                    os.mkdir(destination)
+
+                    start = time.time()
+                    backend.extract(filename, destination)
+                    duration += time.time() - start
+                results[backend.name] = list_tree(destination)
+                shutil.rmtree(destination)
+
+                print '  %-8s %8.2f s  %d files' % (backend.name,
+                                                    duration / options.repeat,
+                                                    len(results[backend.name]))
+
+            if len(set([tuple(files) for files in results.values()])) > 1:
+                print '  WARNING: The backends extracted different files'
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
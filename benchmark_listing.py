@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Script to compare the speed of the directory listing parser backends on
+saved listings. Without arguments the Apache and nginx listings of
+fixtures/listings are used."""
+
+from optparse import OptionParser
+import glob
+import os
+import time
+
+from libs import scraper
+
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'fixtures', 'listings')
+
+
+def generate_listing(count):
+    """Return an Apache style listing with the given number of folders"""
+
+    rows = ['<tr><td valign="top"><img src="/icons/folder.gif" alt="[DIR]"></td>'
+            '<td><a href="%(NAME)s/">%(NAME)s/</a></td>'
+            '<td align="right">12-Mar-2012 04:20  </td>'
+            '<td align="right">  - </td></tr>' % {'NAME': 1331550000 + index}
+            for index in range(count)]
+
+    return '<html><head><title>Index of /pub</title></head><body>' \
+           '<h1>Index of /pub</h1><table>' \
+           '<tr><th><a href="?C=N;O=D">Name</a></th></tr>' \
+           '<tr><td><a href="/pub/">Parent Directory</a></td></tr>' + \
+           '\n'.join(rows) + '</table></body></html>'
+
+
+def parse(backend, data):
+    """Parse the listing in chunks like DirectoryParser does"""
+
+    parser = scraper.PARSER_BACKENDS[backend]()
+    for index in range(0, len(data), scraper.LISTING_CHUNK_SIZE):
+        parser.feed(data[index:index + scraper.LISTING_CHUNK_SIZE])
+    parser.close()
+
+    return parser.entries
+
+
+def main():
+    usage = 'usage: %prog [options] [listing ...]'
+    parser = OptionParser(usage=usage, description=__doc__)
+    parser.add_option('--generate',
+                      dest='entries',
+                      default=None,
+                      type='int',
+                      metavar='ENTRIES',
+                      help='Also parse a generated Apache listing with the '
+                           'given number of entries')
+    parser.add_option('--repeat', '-r',
+                      dest='repeat',
+                      default=10,
+                      type='int',
+                      metavar='REPEAT',
+                      help='Number of times each listing is parsed, default: 10')
+    (options, args) = parser.parse_args()
+
+    fixtures = [ ]
+    for filename in args or sorted(glob.glob(os.path.join(FIXTURES_PATH, '*.html'))):
+        f = open(filename, 'rb')
+        try:
+            fixtures.append((filename, f.read()))
+        finally:
+            f.close()
+
+    if options.entries:
+        fixtures.append(('generated listing with %d entries' % options.entries,
+                         generate_listing(options.entries)))
+
+    for (name, data) in fixtures:
+        print '%s (%d bytes):' % (name, len(data))
+
+        results = { }
+        for backend in sorted(scraper.PARSER_BACKENDS.keys()):
+            start = time.time()
+            for i in range(options.repeat):
+                results[backend] = parse(backend, data)
+            duration = (time.time() - start) / options.repeat
+
+            print '  %-6s %8.2f ms  %d entries' % (backend, duration * 1000,
+                                                   len(results[backend]))
+
+        if len(set([tuple(entries) for entries in results.values()])) > 1:
+            print '  WARNING: The backends returned different entries'
+
+if __name__ == '__main__':
+    main()
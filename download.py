@@ -38,11 +38,16 @@
 
 """Script to download builds for Firefox and Thunderbird from the Mozilla server."""
 
+from datetime import datetime, timedelta
 from optparse import OptionParser, OptionGroup
 import os
 import sys
 
+from libs.matrix import add_options, create_matrix, print_results, \
+                        print_statistics, write_manifest
+from libs.mirror_sync import MirrorSync
 from libs import scraper
+from libs import transfer
 
 
 APPLICATIONS = ['firefox', 'thunderbird']
@@ -58,6 +63,7 @@ def main():
 
     usage = 'usage: %prog [options]'
     parser = OptionParser(usage=usage, description=__doc__)
+    add_options(parser)
     parser.add_option('--application', '-a',
                       dest='application',
                       choices=APPLICATIONS,
@@ -71,6 +77,18 @@ def main():
                       metavar='DIRECTORY',
                       help='Target directory for the download, default: '
                            'current working directory')
+    parser.add_option('--from-manifest',
+                      dest='from_manifest',
+                      default=None,
+                      metavar='MANIFEST',
+                      help='Download the builds listed in a manifest created '
+                           'with --resolve-only')
+    parser.add_option('--install',
+                      dest='install',
+                      default=None,
+                      metavar='DIRECTORY',
+                      help='Install the builds into sub folders of the given '
+                           'directory while they are being downloaded')
     parser.add_option('--build-number',
                       dest='build_number',
                       default=None,
@@ -79,15 +97,33 @@ def main():
                       help='Number of the build (for candidate, daily, '
                            'and tinderbox builds)')
     parser.add_option('--locale', '-l',
-                      dest='locale',
-                      default='en-US',
+                      dest='locales',
+                      action='append',
+                      default=[ ],
                       metavar='LOCALE',
-                      help='Locale of the application, default: "en-US"')
+                      help='Locale of the application, can be specified '
+                           'multiple times, default: "en-US"')
     parser.add_option('--platform', '-p',
-                      dest='platform',
+                      dest='platforms',
+                      action='append',
+                      default=[ ],
                       choices=scraper.PLATFORM_FRAGMENTS.keys(),
                       metavar='PLATFORM',
-                      help='Platform of the application')
+                      help='Platform of the application, can be specified '
+                           'multiple times')
+    parser.add_option('--sync-mirror',
+                      dest='sync_mirror',
+                      default=None,
+                      metavar='DIRECTORY',
+                      help='Copy new or changed files of the selected builds '
+                           'into a local mirror of the build server')
+    parser.add_option('--segments',
+                      dest='segments',
+                      default=transfer.DEFAULT_SEGMENTS,
+                      type="int",
+                      metavar='SEGMENTS',
+                      help='Number of connections to download the build with, '
+                           'default: %d' % transfer.DEFAULT_SEGMENTS)
     parser.add_option('--type', '-t',
                       dest='type',
                       choices=BUILD_TYPES.keys(),
@@ -129,6 +165,13 @@ def main():
                      default=None,
                      metavar='DATE',
                      help='Date of the build, default: latest build')
+    group.add_option('--retention',
+                     dest='retention',
+                     default=None,
+                     type='int',
+                     metavar='DAYS',
+                     help='Use all builds of the last days. Older builds '
+                          'get removed from a mirror')
     parser.add_option_group(group)
 
     # Option group for tinderbox builds
@@ -146,35 +189,79 @@ def main():
     # Check for required options and arguments
     # Note: Will be optional when ini file support has been landed
     if not options.type in ['daily', 'tinderbox'] \
-       and not options.version:
+       and not options.version and not options.from_manifest:
         parser.error('The version of the application to download has not been specified.')
 
-    # Instantiate scraper and download the build
-    scraper_keywords = {'application': options.application,
-                        'locale': options.locale,
-                        'platform': options.platform,
-                        'version': options.version,
-                        'directory': options.directory}
-    scraper_options = {'candidate': {
-                           'build_number': options.build_number,
-                           'no_unsigned': options.no_unsigned},
-                       'daily': {
-                           'branch': options.branch,
-                           'build_number': options.build_number,
-                           'build_id': options.build_id,
-                           'date': options.date},
-                       'tinderbox': {
-                           'branch': options.branch,
-                           'build_number': options.build_number,
-                           'date': options.date,
-                           'debug_build': options.debug_build}
-                       }
-
-    kwargs = scraper_keywords.copy()
-    kwargs.update(scraper_options.get(options.type, {}))
-    build = BUILD_TYPES[options.type](**kwargs)
-
-    build.download()
+    matrix = create_matrix(options)
+
+    if options.from_manifest:
+        matrix.add_manifest(options.from_manifest, options.directory,
+                            options.segments)
+    else:
+        # Add a build for each combination of platform and locale
+        for platform in options.platforms or [None]:
+            for locale in options.locales or ['en-US']:
+                scraper_keywords = {'application': options.application,
+                                    'locale': locale,
+                                    'platform': platform,
+                                    'segments': options.segments,
+                                    'version': options.version,
+                                    'directory': options.directory}
+                scraper_options = {'candidate': {
+                                       'build_number': options.build_number,
+                                       'no_unsigned': options.no_unsigned},
+                                   'daily': {
+                                       'branch': options.branch,
+                                       'build_number': options.build_number,
+                                       'build_id': options.build_id,
+                                       'date': options.date},
+                                   'tinderbox': {
+                                       'branch': options.branch,
+                                       'build_number': options.build_number,
+                                       'date': options.date,
+                                       'debug_build': options.debug_build}
+                                   }
+
+                kwargs = scraper_keywords.copy()
+                kwargs.update(scraper_options.get(options.type, {}))
+
+                if options.type == 'daily' and options.retention:
+                    # Add all daily builds of the last days
+                    for key in ('build_id', 'build_number', 'date'):
+                        del kwargs[key]
+                    end = datetime.now()
+                    start = end - timedelta(days=options.retention)
+                    for build in scraper.iter_daily_builds(start.strftime('%Y-%m-%d'),
+                                                           end.strftime('%Y-%m-%d'),
+                                                           **kwargs):
+                        matrix.add(BUILD_TYPES[options.type],
+                                   build_number=build.build_index + 1,
+                                   date=build.date.strftime('%Y-%m-%d'),
+                                   monthly_builds=build.monthly_builds,
+                                   **kwargs)
+                else:
+                    matrix.add(BUILD_TYPES[options.type], **kwargs)
+
+    if options.sync_mirror:
+        sync = MirrorSync(options.sync_mirror, segments=options.segments)
+        results = matrix.process(sync.sync_build)
+        if options.type == 'daily' and options.retention:
+            sync.prune_daily_builds(options.application, options.retention)
+        sync.save()
+        print 'Mirrored files: %(transferred)d transferred, ' \
+              '%(unchanged)d unchanged, %(removed)d removed' % sync.stats
+    elif options.manifest:
+        results = matrix.resolve()
+        write_manifest(options.manifest, results)
+    elif options.install:
+        results = matrix.install(options.install)
+    else:
+        results = matrix.download()
+    print_results(results)
+    print_statistics()
+
+    if [result for result in results if result['status'] == 'failed']:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,189 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module for a machine-wide cache of downloaded builds."""
+
+
+import hashlib
+import os
+import shutil
+
+from lru_index import LRUIndex
+
+
+# Default size of the cache in bytes
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024 * 1024
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(filename, algorithm='sha512'):
+    """Return the hex digest of the content of the given file"""
+
+    digest = hashlib.new(algorithm)
+    f = open(filename, 'rb')
+    try:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+
+def link_or_copy(source, target):
+    """Create a hardlink of the source file, or copy it if the platform or
+       file system does not support hardlinks. Returns True if the file has
+       been hardlinked."""
+
+    try:
+        os.link(source, target)
+        return True
+    except (AttributeError, OSError):
+        shutil.copy2(source, target)
+        return False
+
+
+class BuildCache(object):
+    """Class for a content-addressed cache of builds.
+
+    Each build is stored once under the SHA-512 digest of its content. The
+    index maps the final URLs of builds to those digests and keeps track of
+    the last access time of each object. Once the size of all objects exceeds
+    the byte budget the least recently used objects get removed. All changes
+    of the index are guarded by a lock file, so the cache can be shared by
+    several processes.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+
+        self.objects_path = os.path.join(self.directory, 'objects')
+        if not os.path.isdir(self.objects_path):
+            os.makedirs(self.objects_path)
+
+        self._index = LRUIndex(self.directory, 'objects', self.recover_index)
+
+
+    def add(self, url, filename, digest=None):
+        """Add the file downloaded from the URL to the cache and return its
+           digest."""
+
+        if digest is None:
+            digest = file_digest(filename)
+
+        lock = self._index.lock()
+        lock.acquire()
+        try:
+            index = self._index.read()
+
+            path = self.object_path(digest)
+            if not os.path.isfile(path):
+                # Copy into a temporary file first so the object is never
+                # visible with partial content
+                tmp_file = path + '.tmp'
+                link_or_copy(filename, tmp_file)
+                os.rename(tmp_file, path)
+
+            index['urls'][url] = digest
+            self._index.touch(index, digest, size=os.path.getsize(path))
+
+            self.evict(index)
+            self._index.write(index)
+        finally:
+            lock.release()
+
+        return digest
+
+
+    def discard(self, url):
+        """Remove the cached build of the URL, e.g. if its content does not
+           match the checksums of the build."""
+
+        lock = self._index.lock()
+        lock.acquire()
+        try:
+            index = self._index.read()
+            digest = index['urls'].pop(url, None)
+            if digest in index['objects']:
+                self.remove_object(digest)
+                del index['objects'][digest]
+
+            self.prune_urls(index)
+            self._index.write(index)
+        finally:
+            lock.release()
+
+
+    def evict(self, index):
+        """Remove least recently used objects until the cache fits into
+           the byte budget."""
+
+        self._index.evict(index, self.max_size, self.remove_object)
+        self.prune_urls(index)
+
+
+    def materialize(self, url, target):
+        """Create the target from the cached build of the URL. Returns the
+           digest of the build, or None if it is not cached."""
+
+        lock = self._index.lock()
+        lock.acquire()
+        try:
+            index = self._index.read()
+            digest = index['urls'].get(url)
+            if digest is None or digest not in index['objects']:
+                return None
+
+            path = self.object_path(digest)
+            if not os.path.isfile(path):
+                return None
+
+            link_or_copy(path, target)
+
+            self._index.touch(index, digest)
+            self._index.write(index)
+
+            return digest
+        finally:
+            lock.release()
+
+
+    def object_path(self, digest):
+        """Return the path of the object with the given digest"""
+
+        return os.path.join(self.objects_path, digest)
+
+
+    def prune_urls(self, index):
+        """Forget about URLs whose objects have been removed"""
+
+        for (url, digest) in index['urls'].items():
+            if digest not in index['objects']:
+                del index['urls'][url]
+
+
+    def recover_index(self):
+        """Return a new index with the objects of the objects folder"""
+
+        objects = { }
+        for digest in os.listdir(self.objects_path):
+            path = self.object_path(digest)
+            if os.path.isfile(path) and not digest.endswith('.tmp'):
+                objects[digest] = {'size': os.path.getsize(path),
+                                   'last_access': os.path.getmtime(path)}
+        return {'urls': { }, 'objects': objects}
+
+
+    def remove_object(self, digest):
+        """Remove the object with the given digest"""
+
+        print 'Removing build from cache: %s' % digest
+        try:
+            os.remove(self.object_path(digest))
+        except OSError:
+            pass
@@ -10,9 +10,12 @@ import tempfile
 from urlparse import urlsplit
 
 import application
+from build_cache import BuildCache
 import errors
 from install import Installer
+from install_cache import InstallCache, DEFAULT_MAX_SIZE
 from json_file import JSONFile
+import scraper
 from scraper import ReleaseScraper
 from testrun import *
 
@@ -26,6 +29,24 @@ class CompatibleByDefault:
 
         self.staging_path = os.path.abspath(self._config['settings']['staging_path'])
 
+        # Builds can be taken from a local mirror of the build server
+        if self._config['settings'].get('base_url'):
+            scraper.BASE_URL = self._config['settings']['base_url'].rstrip('/')
+
+        # Builds are shared with other test-runs if a build cache is configured
+        if self._config['settings'].get('build_cache'):
+            scraper.build_cache = BuildCache(self._config['settings']['build_cache'])
+
+        # Installations are cloned from the install cache if it is configured.
+        # The update tests modify the installation, so nothing is hardlinked.
+        self.install_cache = None
+        if self._config['settings'].get('install_cache'):
+            max_size = self._config['settings'].get('install_cache_size',
+                                                    DEFAULT_MAX_SIZE / 1024 / 1024)
+            self.install_cache = InstallCache(self._config['settings']['install_cache'],
+                                              max_size * 1024 * 1024,
+                                              hardlinks=False)
+
 
     @property
     def platform(self):
@@ -69,7 +90,10 @@ class CompatibleByDefault:
                 # Install the specified build so we don't have to do it for
                 # each individual testrun.
                 install_path = tempfile.mkdtemp('.binary')
-                folder = Installer().install(build, install_path)
+                if self.install_cache:
+                    folder = self.install_cache.install(build, install_path)
+                else:
+                    folder = Installer().install(build, install_path)
                 binary = application.get_binary('firefox', folder)
 
                 # Setup all necessary testrun options to test the build
@@ -0,0 +1,90 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module for advisory file locks shared between processes."""
+
+
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock(object):
+    """Class for an advisory lock on a file.
+
+    Shared locks are only supported via fcntl. On Windows every lock is
+    exclusive. The lock file itself is never removed, so all processes lock
+    the same inode.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self._fd = None
+
+
+    def acquire(self, shared=False, blocking=True):
+        """Acquire the lock. Returns False if the lock is held by someone else
+           and blocking is disabled."""
+
+        folder = os.path.dirname(self.filename)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Another process may have created the folder in the meantime
+                if not os.path.isdir(folder):
+                    raise
+
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT)
+        try:
+            if fcntl:
+                flags = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                if not blocking:
+                    flags |= fcntl.LOCK_NB
+                try:
+                    fcntl.flock(fd, flags)
+                except IOError:
+                    if blocking:
+                        raise
+                    os.close(fd)
+                    return False
+            else:
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                        break
+                    except IOError:
+                        if not blocking:
+                            os.close(fd)
+                            return False
+                        time.sleep(0.1)
+        except:
+            os.close(fd)
+            raise
+
+        self._fd = fd
+        return True
+
+
+    def release(self):
+        """Release the lock"""
+
+        if self._fd is None:
+            return
+
+        try:
+            if fcntl:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, 0)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,425 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module to share persistent HTTP connections between requests."""
+
+
+import base64
+from email.utils import formatdate
+import httplib
+import os
+import re
+import socket
+import StringIO
+import threading
+import time
+import urllib
+import urlparse
+
+import metrics
+
+
+# Maximum number of idle connections kept open per host
+MAX_IDLE_CONNECTIONS = 8
+
+MAX_REDIRECTS = 5
+
+# Timeout in seconds for socket operations
+TIMEOUT = 60
+
+REDIRECT_CODES = (301, 302, 303, 307)
+
+
+class HTTPError(Exception):
+    """Exception for a response with an error status code"""
+    def __init__(self, code, url):
+        self.code = code
+        self.url = url
+        Exception.__init__(self, 'HTTP Error %d: %s' % (code, url))
+
+
+class PooledResponse(object):
+    """Class to wrap a response which hands its connection back to the pool
+    once the body has been read completely."""
+
+    def __init__(self, pool, key, connection, response, url):
+        self.url = url
+
+        self._connection = connection
+        self._key = key
+        self._pool = pool
+        self._response = response
+
+
+    def __del__(self):
+        # An abandoned response must not keep its connection slot forever
+        self.close()
+
+
+    def close(self):
+        """Close the response. If the body has not been read completely the
+           connection cannot be reused and gets closed too."""
+
+        if self._connection is None:
+            return
+
+        if self._response.isclosed() and not self._response.will_close:
+            self._pool.release(self._key, self._connection)
+        else:
+            self._response.close()
+            self._pool.discard(self._key, self._connection)
+        self._connection = None
+
+
+    def getcode(self):
+        """Return the status code of the response"""
+
+        return self._response.status
+
+
+    def getheader(self, name, default=None):
+        """Return the value of the given response header"""
+
+        return self._response.getheader(name, default)
+
+
+    def read(self, amt=None):
+        """Read the body of the response"""
+
+        data = self._response.read(amt)
+        if amt is None or not data:
+            self.close()
+        return data
+
+
+class FileResponse(object):
+    """Class for the response to a request of a file:// URL.
+
+    Local mirrors of the build server can be used like a remote server. Files
+    support Range requests, and folders are returned as a listing in the
+    format of the Apache server.
+    """
+
+    def __init__(self, url, headers=None, method='GET'):
+        self.url = url
+
+        self._code = 200
+        self._headers = { }
+        self._file = None
+        self._remaining = 0
+
+        path = urllib.url2pathname(urlparse.urlsplit(url).path)
+        if os.path.isdir(path):
+            data = self.listing(path)
+            self._file = StringIO.StringIO(data)
+            self._remaining = len(data)
+            self._headers['content-length'] = str(len(data))
+            self._headers['content-type'] = 'text/html'
+        elif os.path.isfile(path):
+            self.open_file(path, (headers or { }).get('Range'))
+        else:
+            self._code = 404
+
+        if method == 'HEAD':
+            self.close()
+
+
+    def close(self):
+        """Close the response"""
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+    def getcode(self):
+        """Return the status code of the response"""
+
+        return self._code
+
+
+    def getheader(self, name, default=None):
+        """Return the value of the given response header"""
+
+        return self._headers.get(name.lower(), default)
+
+
+    def listing(self, path):
+        """Return the HTML listing of the folder"""
+
+        links = [ ]
+        for name in sorted(os.listdir(path)):
+            # Hide files of downloads in progress and of the mirror itself
+            if name.startswith('.') or name.endswith(('.part', '.part.json')):
+                continue
+
+            if os.path.isdir(os.path.join(path, name)):
+                name += '/'
+            links.append('<tr><td><a href="%s">%s</a></td></tr>' %
+                         (urllib.quote(name), name))
+
+        return '<html><body><table>\n%s\n</table></body></html>' % \
+               '\n'.join(links)
+
+
+    def open_file(self, path, range_header=None):
+        """Open the file and seek to the requested range"""
+
+        size = os.path.getsize(path)
+        mtime = os.path.getmtime(path)
+        self._headers['etag'] = '"%x-%x"' % (size, int(mtime))
+        self._headers['last-modified'] = formatdate(mtime, usegmt=True)
+        self._headers['accept-ranges'] = 'bytes'
+
+        start = 0
+        end = size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)$', range_header or '')
+        if match and int(match.group(1)) < size:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(end, int(match.group(2)))
+            self._code = 206
+            self._headers['content-range'] = 'bytes %d-%d/%d' % (start, end, size)
+
+        self._headers['content-length'] = str(end - start + 1)
+        self._remaining = end - start + 1
+
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+
+
+    def read(self, amt=None):
+        """Read the body of the response"""
+
+        if self._file is None:
+            return ''
+
+        if amt is None or amt > self._remaining:
+            amt = self._remaining
+        data = self._file.read(amt)
+        self._remaining -= len(data)
+
+        if not self._remaining:
+            self.close()
+        return data
+
+
+class ConnectionPool(object):
+    """Class to manage persistent connections to HTTP servers.
+
+    Connections are kept open after a response has been consumed and are
+    reused by later requests to the same host. The pool is thread-safe, but
+    each connection is only used by a single request at a time. If
+    max_per_host is set, requests wait until less connections to the host
+    are in use, which includes all segments of downloads.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_CONNECTIONS, timeout=TIMEOUT,
+                 max_per_host=None):
+        self.max_idle = max_idle
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+
+        # Counters to measure the efficiency of the pool
+        self.opened = 0
+        self.reused = 0
+
+        self._active = { }
+        self._idle = { }
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+
+    def acquire(self, key):
+        """Return an idle connection for the host or create a new one.
+           The second value of the result tells if the connection is reused."""
+
+        self._lock.acquire()
+        try:
+            while self.max_per_host and \
+                  self._active.get(key, 0) >= self.max_per_host:
+                self._available.wait()
+            self._active[key] = self._active.get(key, 0) + 1
+
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return (idle.pop(), True)
+            self.opened += 1
+        finally:
+            self._lock.release()
+
+        (scheme, host) = key
+        proxy = get_proxy(scheme, host)
+        if proxy is None:
+            if scheme == 'https':
+                connection = httplib.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                connection = httplib.HTTPConnection(host, timeout=self.timeout)
+        elif scheme == 'https':
+            # Tunnel the encrypted connection through the proxy
+            (proxy_host, headers) = proxy
+            connection = httplib.HTTPSConnection(proxy_host, timeout=self.timeout)
+            connection.set_tunnel(host, headers=headers)
+        else:
+            connection = httplib.HTTPConnection(proxy[0], timeout=self.timeout)
+        return (connection, False)
+
+
+    def clear(self):
+        """Close all idle connections"""
+
+        self._lock.acquire()
+        try:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle = { }
+        finally:
+            self._lock.release()
+
+
+    def discard(self, key, connection):
+        """Close a connection which cannot be reused"""
+
+        connection.close()
+        self.release(key, None)
+
+
+    def release(self, key, connection):
+        """Hand back a connection for later reuse"""
+
+        self._lock.acquire()
+        try:
+            self._active[key] -= 1
+            # Waiters for all hosts share the condition
+            self._available.notify_all()
+
+            idle = self._idle.setdefault(key, [ ])
+            if connection is not None and len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        finally:
+            self._lock.release()
+
+        if connection is not None:
+            connection.close()
+
+
+    def request(self, url, method='GET', headers=None,
+                max_redirects=MAX_REDIRECTS):
+        """Send a request and return the response. Redirects are followed."""
+
+        for i in range(max_redirects + 1):
+            response = self.send(url, method, headers or { })
+            if response.getcode() not in REDIRECT_CODES:
+                return response
+
+            location = response.getheader('Location')
+            response.read()
+            if not location:
+                return response
+
+            metrics.record('redirect', url, 0, status=response.getcode(),
+                           location=location)
+            url = urlparse.urljoin(url, location)
+
+        raise HTTPError(response.getcode(), url)
+
+
+    def send(self, url, method, headers):
+        """Send a single request on a pooled connection"""
+
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        selector = parts.path or '/'
+        if parts.query:
+            selector += '?' + parts.query
+
+        # Requests via a proxy need the absolute URI
+        proxy = get_proxy(parts.scheme, parts.netloc)
+        if proxy is not None and parts.scheme == 'http':
+            selector = urlparse.urlunsplit(parts[:4] + ('', ))
+            headers = dict(headers, **proxy[1])
+
+        while True:
+            (connection, reused) = self.acquire(key)
+            try:
+                if not reused:
+                    start = time.time()
+                    connection.connect()
+                    metrics.record('connect', url, time.time() - start)
+
+                start = time.time()
+                connection.request(method, selector, headers=headers)
+                response = connection.getresponse()
+                metrics.record('first_byte', url, time.time() - start,
+                               method=method, reused=reused,
+                               status=response.status)
+                break
+            except (httplib.HTTPException, socket.error):
+                self.discard(key, connection)
+
+                # The server may have closed an idle connection in the meantime
+                if not reused:
+                    raise
+
+        response = PooledResponse(self, key, connection, response, url)
+
+        # The body of a HEAD request is always empty, so the connection can
+        # be handed back at once
+        if method == 'HEAD':
+            response.read()
+
+        return response
+
+
+    def stats(self):
+        """Return the counters of the pool"""
+
+        return {'opened': self.opened,
+                'reused': self.reused}
+
+
+# Pool shared by all modules
+pool = ConnectionPool()
+
+
+def get_proxy(scheme, host):
+    """Return the address of the proxy for requests to the host and the
+       headers to authenticate with it, or None if the host is accessed
+       directly. Like urllib the proxy settings of the environment are
+       used, e.g. http_proxy, https_proxy and no_proxy."""
+
+    proxy = urllib.getproxies().get(scheme)
+    if not proxy or urllib.proxy_bypass(host):
+        return None
+
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    parts = urlparse.urlsplit(proxy)
+
+    headers = { }
+    if parts.username:
+        credentials = '%s:%s' % (urllib.unquote(parts.username),
+                                 urllib.unquote(parts.password or ''))
+        headers['Proxy-Authorization'] = 'Basic ' + \
+                                         base64.b64encode(credentials)
+
+    return (parts.netloc.rpartition('@')[2], headers)
+
+
+def urlopen(url, headers=None, method='GET'):
+    """Send a request via the shared pool. Raises HTTPError if the server
+       responds with an error status code. URLs of local files are read
+       directly."""
+
+    if url.startswith('file:'):
+        response = FileResponse(url, headers, method)
+    else:
+        response = pool.request(url, method, headers)
+    if response.getcode() >= 400:
+        response.close()
+        raise HTTPError(response.getcode(), url)
+    return response
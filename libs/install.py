@@ -34,24 +34,516 @@
 #
 # ***** END LICENSE BLOCK *****
 
+import atexit
+import binascii
+import bz2
+import collections
+from distutils.spawn import find_executable
 import glob
+import mmap
+import multiprocessing
 import os
+import Queue
 import shutil
 import subprocess
 import sys
+import tarfile
 import tempfile
+import threading
 import time
 
 
+# Number of chunks buffered between the download and the extraction
+STREAM_QUEUE_SIZE = 256
+
+# Number of bzip2 blocks per process which are decompressed ahead of the
+# extraction
+BLOCKS_PER_PROCESS = 2
+
+# Folder where removed installations wait for their deletion, and the name
+# of the trash folder next to installations on other file systems
+TRASH_PATH = os.path.join(tempfile.gettempdir(), "mozmill-automation-trash")
+TRASH_NAME = ".mozmill-trash"
+
+# Bit patterns which start a compressed block and end a stream of bzip2
+BZIP2_BLOCK_MAGIC = 0x314159265359
+BZIP2_END_MAGIC = 0x177245385090
+
+
 class TimeoutError(Exception):
     """Exception for Timeouts."""
     def __init__(self, message):
         Exception.__init__(self, message)
 
 
+class StreamReader(object):
+    """ File-like object which reads the chunks returned by a callable until
+        it returns None. """
+
+    def __init__(self, get):
+        self.closed = False
+        self.get = get
+
+        # Chunks which have not been read completely, the read position in
+        # the first one, and the number of unread bytes
+        self._chunks = collections.deque()
+        self._offset = 0
+        self._size = 0
+
+    def read(self, size=-1):
+        while not self.closed and (size < 0 or self._size < size):
+            data = self.get()
+            if data is None:
+                self.closed = True
+            elif data:
+                self._chunks.append(data)
+                self._size += len(data)
+
+        if size < 0 or size > self._size:
+            size = self._size
+
+        # Only copy the requested bytes instead of the remaining chunk
+        pieces = [ ]
+        remaining = size
+        while remaining:
+            chunk = self._chunks[0]
+            available = len(chunk) - self._offset
+            if available <= remaining:
+                pieces.append(chunk[self._offset:] if self._offset else chunk)
+                self._chunks.popleft()
+                self._offset = 0
+                remaining -= available
+            else:
+                pieces.append(chunk[self._offset:self._offset + remaining])
+                self._offset += remaining
+                remaining = 0
+
+        self._size -= size
+        return "".join(pieces)
+
+
+class StreamExtractor(object):
+    """ Sink which extracts a tar.bz2 archive while it is being written.
+
+    The data has to be passed in order via write(), e.g. by a download. The
+    archive gets decompressed and extracted by a background thread, so the
+    build is installed at the time the last byte has been received. Like
+    'tar --strip-components=1' the top-level folder of the archive is
+    stripped.
+    """
+
+    def __init__(self, destination, queue_size=STREAM_QUEUE_SIZE):
+        self.destination = destination
+        self.error = None
+
+        self._queue = Queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self.extract)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def abort(self):
+        """ Stop the extraction of an incomplete archive. """
+
+        self._put(None)
+        self._thread.join()
+
+    def close(self):
+        """ Wait until the archive has been extracted completely. """
+
+        self._put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def extract(self):
+        """ Extract the members of the archive while they arrive. """
+
+        reader = StreamReader(self._queue.get)
+        try:
+            try:
+                extract_members(tarfile.open(fileobj=reader, mode="r|bz2"),
+                                self.destination)
+            except Exception, e:
+                self.error = e
+        finally:
+            # Drain the remaining data so the writer doesn't block
+            while not reader.closed:
+                reader.closed = self._queue.get() is None
+
+    def write(self, data):
+        """ Pass the next chunk of the archive to the extraction. A failed
+            extraction doesn't abort the writer, it gets raised by close(). """
+
+        self._put(data)
+
+    def _put(self, data):
+        if self._thread.is_alive():
+            self._queue.put(data)
+
+
+class Reaper(object):
+    """ Deletes trashed folders in a background thread.
+
+    The deletion runs with the lowest CPU and I/O priority where possible,
+    so it doesn't slow down a test-run. Folders which are left over after
+    a crash or the exit of the process are deleted once the reaper gets
+    started.
+    """
+
+    def __init__(self):
+        self.areas = set()
+
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._thread = None
+
+    def delete(self, path):
+        """ Schedule the deletion of the folder. """
+
+        self.start()
+        self._queue.put(path)
+
+    def run(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            try:
+                remove_tree(path)
+            except Exception, e:
+                print "*** Folder '%s' could not be removed: %s" % (path, str(e))
+            self._queue.task_done()
+
+    def start(self):
+        """ Start the background thread and delete the leftover trash. """
+
+        self._lock.acquire()
+        try:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+            atexit.register(self.stop)
+        finally:
+            self._lock.release()
+
+        self.sweep(TRASH_PATH)
+
+    def stop(self):
+        """ Finish the current deletion and stop the thread. Pending folders
+            are kept for the next start. """
+
+        while True:
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+            except Queue.Empty:
+                break
+
+        self._queue.put(None)
+        self._thread.join()
+
+    def sweep(self, area):
+        """ Delete all folders of the trash area, once per process. """
+
+        self._lock.acquire()
+        try:
+            if area in self.areas:
+                return
+            self.areas.add(area)
+        finally:
+            self._lock.release()
+
+        if os.path.isdir(area):
+            for name in os.listdir(area):
+                self.delete(os.path.join(area, name))
+
+    def wait(self):
+        """ Wait until all scheduled folders have been deleted. """
+
+        self._queue.join()
+
+
+class TarBackend(object):
+    """ Extracts tar.bz2 archives via tar and its single-threaded bzip2. """
+
+    name = "tar"
+    options = ["-j"]
+
+    def available(self):
+        return find_executable("tar") is not None
+
+    def extract(self, package, destination):
+        cmdArgs = ["tar", "-x"] + self.options + \
+                  ["-f", package, "-C", destination, "--strip-components=1"]
+        if subprocess.call(cmdArgs):
+            raise Exception("Failed to extract %s" % package)
+
+
+class LBzip2Backend(TarBackend):
+    """ Extracts tar.bz2 archives via tar and the multi-threaded lbzip2. """
+
+    name = "lbzip2"
+    options = ["-I", "lbzip2"]
+
+    def available(self):
+        return find_executable(self.name) is not None and \
+               TarBackend.available(self)
+
+
+class PBzip2Backend(LBzip2Backend):
+    """ Extracts tar.bz2 archives via tar and the multi-threaded pbzip2. """
+
+    name = "pbzip2"
+    options = ["-I", "pbzip2"]
+
+
+class BlockBackend(object):
+    """ Extracts tar.bz2 archives in-process with a pool of processes.
+
+    The blocks of a bzip2 stream are compressed independently. They are
+    located via their bit-aligned magic numbers, turned into single-block
+    streams and decompressed in parallel, while the decompressed data gets
+    extracted in order. A magic number which is part of compressed data
+    makes its block fail the CRC check, in that case tar is used.
+    """
+
+    name = "blocks"
+
+    def __init__(self, processes=None):
+        self.processes = processes or multiprocessing.cpu_count()
+
+    def available(self):
+        return True
+
+    def extract(self, package, destination):
+        f = open(package, "rb")
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            try:
+                blocks = imap_bounded(pool, decompress_block, iter_blocks(data),
+                                      BLOCKS_PER_PROCESS * self.processes)
+                reader = StreamReader(lambda: next(blocks, None))
+                extract_members(tarfile.open(fileobj=reader, mode="r|"),
+                                destination)
+            except (IOError, EOFError, tarfile.TarError):
+                print "*** Bzip2 blocks cannot be split, falling back to tar"
+                TarBackend().extract(package, destination)
+        finally:
+            pool.terminate()
+            pool.join()
+            data.close()
+
+
+# Available backends to decompress and extract tar.bz2 archives, the first
+# available one is used by default
+DECOMPRESSION_BACKENDS = [LBzip2Backend, PBzip2Backend, BlockBackend,
+                          TarBackend]
+
+DECOMPRESSION_BACKEND = None
+
+reaper = Reaper()
+
+
+def get_backend(name=None):
+    """ Return the decompression backend with the given name or the best
+        available one. """
+
+    name = name or DECOMPRESSION_BACKEND
+    for backend_class in DECOMPRESSION_BACKENDS:
+        backend = backend_class()
+        if name is None and backend.name == "blocks" and \
+           multiprocessing.cpu_count() < 2:
+            continue
+        if (name is None or name == backend.name) and backend.available():
+            return backend
+
+    raise Exception("Decompression backend %s is not available." % name)
+
+
+def decompress_block(block):
+    """ Decompress a single bzip2 block given as bytes, its bit offset in
+        the first byte and its length in bits. Runs in a pool process. """
+
+    (data, offset, length) = block
+
+    # Cut the bits of the block out of the surrounding bytes
+    value = int(binascii.hexlify(data), 16)
+    value >>= len(data) * 8 - offset - length
+    value &= (1 << length) - 1
+
+    # Stream trailer with the CRC of the single block, padded to full bytes
+    crc = (value >> (length - 80)) & 0xFFFFFFFF
+    value = (((value << 48) | BZIP2_END_MAGIC) << 32) | crc
+    length += 80
+    padding = -length % 8
+    value <<= padding
+
+    stream = "%x" % value
+    stream = "0" * ((length + padding) / 4 - len(stream)) + stream
+    return bz2.decompress("BZh9" + binascii.unhexlify(stream))
+
+
+def extract_members(archive, destination):
+    """ Extract all members of the tar archive without their top-level
+        folder like 'tar --strip-components=1'. """
+
+    for member in archive:
+        # Strip the top-level folder and refuse unsafe paths
+        name = member.name.split("/", 1)
+        if len(name) < 2 or not name[1]:
+            continue
+        if os.path.isabs(name[1]) or ".." in name[1].split("/"):
+            raise Exception("Invalid path in archive: %s" % member.name)
+        member.name = name[1]
+        if member.islnk():
+            member.linkname = member.linkname.split("/", 1)[-1]
+
+        archive.extract(member, destination)
+    archive.close()
+
+
+def find_magic(data, magic):
+    """ Return the bit positions of a 48 bit magic number in the data. """
+
+    positions = [ ]
+    for shift in range(8):
+        # The magic number spans 7 bytes, the inner 5 of them completely
+        value = magic << (8 - shift)
+        mask = 0xFFFFFFFFFFFF << (8 - shift)
+        pattern = binascii.unhexlify("%014x" % value)
+        first = ord(pattern[0]), (mask >> 48) & 0xFF
+        last = ord(pattern[6]), mask & 0xFF
+
+        index = data.find(pattern[1:6], 1)
+        while index != -1:
+            if ord(data[index - 1]) & first[1] == first[0] and \
+               (not last[1] or index + 5 < len(data) and
+                ord(data[index + 5]) & last[1] == last[0]):
+                positions.append((index - 1) * 8 + shift)
+            index = data.find(pattern[1:6], index + 1)
+
+    return positions
+
+
+def imap_bounded(pool, function, iterable, size):
+    """ Like pool.imap(), but with at most size tasks in flight, so the
+        results don't pile up in memory if they are consumed slowly. """
+
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(function, (item, )))
+        if len(pending) >= size:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+
+def iter_blocks(data):
+    """ Yield the compressed blocks of the bzip2 data for decompress_block().
+        Concatenated streams as written by pbzip2 are supported. """
+
+    ends = find_magic(data, BZIP2_END_MAGIC)
+    markers = sorted([(position, True) for position in
+                      find_magic(data, BZIP2_BLOCK_MAGIC)] +
+                     [(position, False) for position in ends])
+    if not ends:
+        raise IOError("No end of a bzip2 stream found")
+
+    for index, (start, is_block) in enumerate(markers):
+        if not is_block:
+            continue
+        if index + 1 == len(markers):
+            raise IOError("Incomplete bzip2 block at bit %d" % start)
+
+        end = markers[index + 1][0]
+        yield (data[start / 8:(end + 7) / 8], start % 8, end - start)
+
+
+def remove_tree(path):
+    """ Delete the folder with the lowest CPU and I/O priority. """
+
+    if sys.platform.startswith("linux") and find_executable("nice"):
+        cmdArgs = ["nice", "-n", "19", "rm", "-rf", path]
+        if find_executable("ionice"):
+            cmdArgs = ["ionice", "-c", "3"] + cmdArgs
+        if subprocess.call(cmdArgs):
+            raise Exception("rm failed")
+    else:
+        shutil.rmtree(path, True)
+
+
+def trash(folder):
+    """ Move the folder into a trash area at once and let the reaper delete
+        it. Returns False if the folder cannot be moved. """
+
+    folder = os.path.normpath(folder)
+
+    # The trash area has to be on the same file system for a rename
+    for area in (TRASH_PATH,
+                 os.path.join(os.path.dirname(os.path.abspath(folder)),
+                              TRASH_NAME)):
+        try:
+            if not os.path.isdir(area):
+                os.makedirs(area)
+            path = tempfile.mkdtemp(prefix=os.path.basename(folder), dir=area)
+        except OSError:
+            continue
+
+        try:
+            os.rename(folder, os.path.join(path, "tree"))
+        except OSError:
+            # Another process might have swept the area already
+            shutil.rmtree(path, True)
+            continue
+
+        reaper.sweep(area)
+        reaper.delete(path)
+        return True
+
+    return False
+
+
 class Installer(object):
     """ Class to handle installers and uninstallers. """
 
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    def install_build(self, build, destination="./"):
+        """ Download a build and install it at the same time. Archives which
+            cannot be extracted while being downloaded are installed after the
+            download has been finished. The archive is kept in any case. """
+
+        destination = os.path.join(destination, "")
+
+        if sys.platform != "linux2" or not build.target.endswith(".tar.bz2"):
+            build.download()
+            return self.install(build.target, destination)
+
+        self.uninstall(destination)
+        if not os.path.isdir(destination):
+            os.makedirs(destination)
+
+        print "*** Installing %s => %s while downloading" % \
+              (os.path.basename(build.target), destination)
+        extractor = StreamExtractor(destination)
+        try:
+            build.download(extractor)
+        except:
+            extractor.abort()
+            raise
+        extractor.close()
+
+        return destination
+
     def install(self, package=None, destination="./"):
         """ Install a binary package on the system. """
 
@@ -88,9 +580,7 @@ class Installer(object):
                 except:
                     pass
 
-                cmdArgs = ["tar", "xjf", package, "-C", destination,
-                           "--strip-components=1"]
-                result = subprocess.call(cmdArgs)
+                get_backend(self.backend).extract(package, destination)
             else:
                 raise Exception("File type %s not supported." % fileExt)
 
@@ -172,13 +662,10 @@ class Installer(object):
         if os.path.exists("%s/%sapplication.ini" % (folder, contents)):
             try:
                 print "*** Removing old installation at %s" % (folder)
-                shutil.rmtree(folder)
 
-                # Wait at maximum 20s for the removal
-                timeout = 20
-                while (os.path.exists(folder) & (timeout > 0)):
-                    time.sleep(1)
-                    timeout -= 1
+                # Move the folder away and delete it in the background
+                if not trash(folder):
+                    shutil.rmtree(folder)
             except:
                 print "*** Folder '%s' could not be removed" % (folder)
                 pass
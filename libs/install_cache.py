@@ -0,0 +1,261 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module for a machine-wide cache of installed builds."""
+
+
+import fnmatch
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from build_cache import file_digest, link_or_copy
+import install
+from json_file import JSONFile
+from lru_index import LRUIndex
+
+
+# Default size of the cache in bytes
+DEFAULT_MAX_SIZE = 5 * 1024 * 1024 * 1024
+
+# Trees which have been used within that number of seconds are never evicted,
+# so they don't get removed while being cloned by another process
+MIN_TREE_AGE = 10 * 60
+
+# Files of an installation which get modified by the application or the
+# tests, e.g. preferences and extensions. They are never hardlinked.
+MUTABLE_PATTERNS = ['*.cfg',
+                    '*.ini',
+                    'defaults/*',
+                    'distribution/*',
+                    'extensions/*',
+                    'searchplugins/*',
+                    'updates/*']
+
+
+def clone_tree(source, destination, hardlinks=True):
+    """Create a copy of the source folder in the existing destination folder
+       and return the method which has been used. Files are cloned via
+       reflinks if the file system supports it, otherwise immutable files
+       get hardlinked and all others copied."""
+
+    if sys.platform.startswith('linux'):
+        devnull = open(os.devnull, 'w')
+        try:
+            result = subprocess.call(['cp', '-a', '--reflink=always',
+                                      os.path.join(source, '.'), destination],
+                                     stderr=devnull)
+        finally:
+            devnull.close()
+        if not result:
+            return 'reflink'
+
+        # Remove what has been copied before cp failed
+        for name in os.listdir(destination):
+            path = os.path.join(destination, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    linked = False
+    for (root, folders, files) in os.walk(source):
+        relative_root = os.path.relpath(root, source)
+        target_root = os.path.normpath(os.path.join(destination, relative_root))
+
+        for name in folders + files:
+            path = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            relative_path = os.path.normpath(os.path.join(relative_root, name))
+
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), target)
+            elif os.path.isdir(path):
+                os.mkdir(target)
+                shutil.copystat(path, target)
+            elif hardlinks and not is_mutable(relative_path):
+                # Copies files if the destination is on another file system
+                linked = link_or_copy(path, target) or linked
+            else:
+                shutil.copy2(path, target)
+
+    return 'hardlink' if linked else 'copy'
+
+
+def is_mutable(path):
+    """Check if the file at the relative path of an installation gets
+       modified by the application"""
+
+    path = path.replace(os.sep, '/')
+    for pattern in MUTABLE_PATTERNS:
+        if fnmatch.fnmatch(path, pattern):
+            return True
+    return False
+
+
+def tree_size(folder):
+    """Return the size of all files in the folder"""
+
+    size = 0
+    for (root, folders, files) in os.walk(folder):
+        for name in files:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                size += os.path.getsize(path)
+    return size
+
+
+class InstallCache(object):
+    """Class for a cache of pristine installations of builds.
+
+    Each installer is installed once into a tree named after the SHA-512
+    digest of the installer, which is taken from the .digests file of a
+    download if present. Further installations of the same installer are
+    cloned from that tree instead of extracting the installer again. Once
+    the size of all trees exceeds the byte budget the least recently used
+    trees get removed. Changes of the index are guarded by a lock file, so
+    the cache can be shared by several processes. Installers are extracted
+    and trees are cloned without holding the lock.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, hardlinks=True):
+        self.directory = os.path.abspath(directory)
+        self.hardlinks = hardlinks
+        self.max_size = max_size
+
+        self.trees_path = os.path.join(self.directory, 'trees')
+        if not os.path.isdir(self.trees_path):
+            os.makedirs(self.trees_path)
+
+        self._index = LRUIndex(self.directory, 'trees', self.recover_index)
+
+
+    def add_tree(self, digest, tmp_path, folder):
+        """Move the installation in the temporary folder into the cache,
+           unless another process has added the tree in the meantime, and
+           return the details of the tree."""
+
+        path = self.tree_path(digest)
+
+        lock = self._index.lock()
+        lock.acquire()
+        try:
+            index = self._index.read()
+
+            if digest not in index['trees'] or not os.path.isdir(path):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, True)
+                os.rename(tmp_path, path)
+                self._index.touch(index, digest, folder=folder,
+                                  size=tree_size(path))
+            else:
+                self._index.touch(index, digest)
+
+            self._index.evict(index, self.max_size, self.remove_tree,
+                              min_age=MIN_TREE_AGE)
+            self._index.write(index)
+
+            return index['trees'][digest]
+        finally:
+            lock.release()
+
+
+    def digest(self, package):
+        """Return the SHA-512 digest of the installer"""
+
+        try:
+            return JSONFile(package + '.digests').read()['sha512']
+        except Exception:
+            return file_digest(package)
+
+
+    def install(self, package, destination):
+        """Install the installer into the destination folder and return the
+           real installation folder like Installer.install()."""
+
+        digest = self.digest(package)
+        path = self.tree_path(digest)
+
+        details = self.use_tree(digest)
+        if details is None:
+            # Install into a temporary folder first so the tree is never
+            # visible with partial content
+            tmp_path = tempfile.mkdtemp(suffix='.tmp', dir=self.trees_path)
+            try:
+                folder = install.Installer().install(package, tmp_path)
+                details = self.add_tree(digest, tmp_path,
+                                        os.path.relpath(folder, tmp_path))
+            finally:
+                # Left over if the installation failed or the tree has been
+                # added by another process in the meantime
+                if os.path.isdir(tmp_path) and not install.trash(tmp_path):
+                    shutil.rmtree(tmp_path, True)
+        else:
+            print 'Installation has been taken from the cache: %s' % digest
+
+        if not os.path.isdir(destination):
+            os.makedirs(destination)
+        method = clone_tree(path, destination, self.hardlinks)
+        print '*** Cloned installation %s => %s (%s)' % (digest[:16],
+                                                         destination,
+                                                         method)
+
+        return os.path.join(os.path.normpath(os.path.join(destination,
+                                                          details['folder'])),
+                            '')
+
+
+    def recover_index(self):
+        """Return a new index with the trees of the trees folder. Only trees
+           of installers which need no sub folder can be recovered."""
+
+        trees = { }
+        for digest in os.listdir(self.trees_path):
+            path = self.tree_path(digest)
+            if digest.endswith('.tmp') or digest == install.TRASH_NAME or \
+               not os.path.isdir(path):
+                continue
+            if os.path.isfile(os.path.join(path, 'application.ini')):
+                trees[digest] = {'folder': '.',
+                                 'size': tree_size(path),
+                                 'last_access': os.path.getmtime(path)}
+            else:
+                shutil.rmtree(path, True)
+        return {'trees': trees}
+
+
+    def remove_tree(self, digest):
+        """Remove the tree with the given digest"""
+
+        print 'Removing installation from cache: %s' % digest
+        if not install.trash(self.tree_path(digest)):
+            shutil.rmtree(self.tree_path(digest), True)
+
+
+    def tree_path(self, digest):
+        """Return the path of the tree with the given digest"""
+
+        return os.path.join(self.trees_path, digest)
+
+
+    def use_tree(self, digest):
+        """Mark the tree as used, so it doesn't get evicted while it is being
+           cloned, and return its details. Returns None if it is not cached."""
+
+        lock = self._index.lock()
+        lock.acquire()
+        try:
+            index = self._index.read()
+            if digest not in index['trees'] or \
+               not os.path.isdir(self.tree_path(digest)):
+                return None
+
+            self._index.touch(index, digest)
+            self._index.write(index)
+
+            return index['trees'][digest]
+        finally:
+            lock.release()
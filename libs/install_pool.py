@@ -0,0 +1,144 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module to install upcoming builds in the background."""
+
+
+import threading
+import time
+
+import install
+import metrics
+
+
+# Default number of installations which are kept ready
+DEFAULT_DEPTH = 1
+
+
+class InstallPool(object):
+    """Class for a pool of ready-to-use installations of a list of binaries.
+
+    A background thread installs the binaries in the given order, so the
+    installation of the next binaries overlaps with the tests of the current
+    one. At most depth installations are kept ready. take() returns a ready
+    installation at once, waits for one which is in progress, or installs
+    the binary itself. The install callable gets a binary and returns the
+    folder of its installation.
+    """
+
+    def __init__(self, binaries, install, depth=DEFAULT_DEPTH):
+        self.depth = max(1, int(depth))
+        self.install = install
+        self.stats = {'hits': 0, 'misses': 0, 'wait_time': 0.0}
+
+        self._condition = threading.Condition()
+        self._installing = None
+        self._pending = list(binaries)
+        self._ready = [ ]
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def close(self):
+        """Stop the background installations and remove all installations
+           which have not been taken."""
+
+        self._condition.acquire()
+        try:
+            self._stopped = True
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+
+        self._thread.join()
+
+        for (binary, folder, error) in self._ready:
+            if folder is not None:
+                install.Installer().uninstall(folder)
+        self._ready = [ ]
+
+
+    def run(self):
+        """Install the pending binaries while less than depth are ready"""
+
+        while True:
+            self._condition.acquire()
+            try:
+                while not self._stopped and \
+                      (not self._pending or len(self._ready) >= self.depth):
+                    self._condition.wait()
+                if self._stopped:
+                    return
+
+                binary = self._installing = self._pending.pop(0)
+            finally:
+                self._condition.release()
+
+            folder = error = None
+            try:
+                folder = self.install(binary)
+            except Exception, e:
+                error = e
+
+            self._condition.acquire()
+            try:
+                self._installing = None
+                self._ready.append((binary, folder, error))
+                self._condition.notify_all()
+            finally:
+                self._condition.release()
+
+
+    def take(self, binary):
+        """Return the folder of an installation of the binary"""
+
+        start = time.time()
+        entry = None
+        hit = True
+
+        self._condition.acquire()
+        try:
+            while True:
+                for ready in self._ready:
+                    if ready[0] == binary:
+                        entry = ready
+                        break
+                if entry is not None or self._installing != binary:
+                    break
+
+                hit = False
+                self._condition.wait()
+
+            if entry is not None:
+                self._ready.remove(entry)
+                self._condition.notify_all()
+            else:
+                # Install it here instead of waiting for the others
+                hit = False
+                if binary in self._pending:
+                    self._pending.remove(binary)
+        finally:
+            self._condition.release()
+
+        if entry is None:
+            try:
+                entry = (binary, self.install(binary), None)
+            except Exception, e:
+                entry = (binary, None, e)
+
+        duration = time.time() - start
+        self._condition.acquire()
+        try:
+            self.stats['hits' if hit else 'misses'] += 1
+            self.stats['wait_time'] += duration
+        finally:
+            self._condition.release()
+        metrics.record('install', binary, duration, hit=hit)
+
+        if entry[2] is not None:
+            raise entry[2]
+        return entry[1]
@@ -0,0 +1,185 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module to cache parsed directory listings on disk."""
+
+
+import calendar
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+
+
+# Seconds after which a cached listing has to be revalidated
+DEFAULT_TTL = 300
+
+# Files of those paths never change once they have been published
+IMMUTABLE_PATHS = [r'/releases/(?!latest)[^/]+/',
+                   r'/nightly/[^/]+-candidates/build\d+/',
+                   r'/nightly/\d{4}/\d{2}/[^/]+',
+                   r'/tinderbox-builds/[^/]+/\d+']
+
+# Folders of those paths are filled while the builds are being uploaded, so
+# their listings only become immutable once they have settled
+PROGRESSIVE_PATHS = [r'/nightly/[^/]+-candidates/build\d+/',
+                     r'/nightly/\d{4}/\d{2}/[^/]+',
+                     r'/tinderbox-builds/[^/]+/\d+']
+
+# Seconds after which the upload into a progressive folder is finished
+SETTLE_TIME = 24 * 60 * 60
+
+
+class ListingCache(object):
+    """Class to store the entries of directory listings keyed by URL.
+
+    Each record contains the entries together with the ETag and Last-Modified
+    headers of the response. Once the TTL has been expired the listing has to
+    be revalidated with a conditional request. Listings of immutable paths
+    never expire. Listings of progressive paths are only treated as immutable
+    once they have been unchanged for the settle time, or have been retrieved
+    at least the settle time after the build date given in the URL.
+    """
+
+    def __init__(self, directory, ttl=DEFAULT_TTL,
+                 immutable_paths=IMMUTABLE_PATHS,
+                 progressive_paths=PROGRESSIVE_PATHS, settle_time=SETTLE_TIME):
+        self.directory = os.path.abspath(directory)
+        self.settle_time = settle_time
+        self.ttl = ttl
+        self.immutable_paths = [re.compile(path) for path in immutable_paths]
+        self.progressive_paths = [re.compile(path)
+                                  for path in progressive_paths]
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+
+    def filename(self, url):
+        """Return the path of the cache file for the URL"""
+
+        return os.path.join(self.directory,
+                            hashlib.sha1(url).hexdigest() + '.json')
+
+
+    def is_fresh(self, url, record):
+        """Check if the record can be used without revalidation"""
+
+        if self.is_immutable(url, record):
+            return True
+
+        return time.time() - record['timestamp'] < self.ttl
+
+
+    def is_immutable(self, url, record):
+        """Check if the cached listing of the URL will never change"""
+
+        for pattern in self.progressive_paths:
+            if pattern.search(url):
+                # Time the entries have been confirmed after the upload
+                unchanged = record['timestamp'] - record.get('changed',
+                                                             record['timestamp'])
+                published = self.published(url)
+                return unchanged >= self.settle_time or \
+                       (published is not None and
+                        record['timestamp'] - published >= self.settle_time)
+
+        for pattern in self.immutable_paths:
+            if pattern.search(url):
+                return True
+        return False
+
+
+    def lookup(self, url):
+        """Return the cached record of the URL or None"""
+
+        try:
+            f = open(self.filename(url), 'r')
+            try:
+                record = json.loads(f.read())
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+
+        if record.get('url') != url:
+            return None
+        return record
+
+
+    def published(self, url):
+        """Return the build date given in the URL as timestamp, or None"""
+
+        match = re.search(r'/tinderbox-builds/[^/]+/(\d{9,})', url)
+        if match:
+            return int(match.group(1))
+
+        match = re.search(r'/nightly/\d{4}/\d{2}/'
+                          r'(\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})-', url)
+        if match:
+            return calendar.timegm(time.strptime(match.group(1),
+                                                 '%Y-%m-%d-%H-%M-%S'))
+
+        return None
+
+
+    def store(self, url, entries, etag=None, last_modified=None):
+        """Store the entries and validators of the listing. Validators which
+           are missing are kept from the previous record of the same entries."""
+
+        now = time.time()
+
+        # Remember since when the entries have not been changed
+        previous = self.lookup(url)
+        if previous is not None and previous['entries'] == entries:
+            changed = previous.get('changed', previous['timestamp'])
+
+            # A 304 response may omit the validators of the listing
+            etag = etag or previous.get('etag')
+            last_modified = last_modified or previous.get('last_modified')
+        else:
+            changed = now
+
+        record = {'url': url,
+                  'entries': entries,
+                  'etag': etag,
+                  'last_modified': last_modified,
+                  'changed': changed,
+                  'timestamp': now}
+
+        # Write to a temporary file first so readers never see partial data
+        (fd, tmp_file) = tempfile.mkstemp('.tmp', dir=self.directory)
+        try:
+            f = os.fdopen(fd, 'w')
+            try:
+                f.write(json.dumps(record))
+            finally:
+                f.close()
+
+            filename = self.filename(url)
+            try:
+                os.rename(tmp_file, filename)
+            except OSError:
+                # On Windows the destination file cannot be replaced
+                os.remove(filename)
+                os.rename(tmp_file, filename)
+        except:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+
+        return record
+
+
+    def validators(self, record):
+        """Return the headers for a conditional request of the listing"""
+
+        headers = { }
+        if record.get('etag'):
+            headers['If-None-Match'] = record['etag']
+        if record.get('last_modified'):
+            headers['If-Modified-Since'] = record['last_modified']
+        return headers
@@ -0,0 +1,89 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module for the index of a machine-wide cache with a byte budget."""
+
+
+import os
+import time
+
+from file_lock import FileLock
+from json_file import JSONFile
+
+
+class LRUIndex(object):
+    """Class for the JSON index of a cache which is shared by several
+    processes.
+
+    The entries of the given section map the keys of cached items to their
+    size and last access time. Once the size of all items exceeds the byte
+    budget the least recently used ones get removed. All changes of the
+    index have to be done while holding the lock. If the index is missing or
+    corrupted the recover callable has to return a new one.
+    """
+
+    def __init__(self, directory, section, recover):
+        self.directory = directory
+        self.section = section
+
+        self._file = JSONFile(os.path.join(directory, 'index.json'))
+        self._recover = recover
+
+
+    def evict(self, index, max_size, remove, min_age=0):
+        """Remove least recently used items until the cache fits into the
+           byte budget and return their keys. Items accessed within the last
+           min_age seconds are never removed. The remove callable gets the
+           key of an item and deletes its data."""
+
+        entries = sorted(index[self.section].items(),
+                         key=lambda item: item[1]['last_access'])
+        size = sum([details['size'] for (key, details) in entries])
+
+        removed = [ ]
+        for (key, details) in entries:
+            if size <= max_size:
+                break
+            if time.time() - details['last_access'] < min_age:
+                continue
+
+            remove(key)
+            del index[self.section][key]
+            removed.append(key)
+            size -= details['size']
+
+        return removed
+
+
+    def lock(self):
+        """Return a new lock for the index"""
+
+        return FileLock(os.path.join(self.directory, 'lock'))
+
+
+    def read(self):
+        """Read the index, or recover it if it is missing or corrupted"""
+
+        try:
+            index = self._file.read()
+            if self.section in index:
+                return index
+        except Exception:
+            pass
+
+        return self._recover()
+
+
+    def touch(self, index, key, **details):
+        """Update the last access time and the given details of the item"""
+
+        entry = index[self.section].setdefault(key, { })
+        entry.update(details)
+        entry['last_access'] = time.time()
+
+
+    def write(self, index):
+        """Store the index"""
+
+        self._file.write(index)
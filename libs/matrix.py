@@ -0,0 +1,338 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module to process a matrix of builds with a bounded pool of workers."""
+
+
+import os
+import Queue
+import threading
+import time
+
+import build_cache
+import http_pool
+import install
+from json_file import JSONFile
+import listing_cache
+import metrics
+import mirrors
+import scraper
+import transfer
+
+
+class ManifestBuild(object):
+    """Class for a build listed in a manifest, which can be downloaded without
+    crawling the directory listings again."""
+
+    def __init__(self, url, target, directory=None,
+                 segments=transfer.DEFAULT_SEGMENTS, checksums=None, **details):
+        self.checksums = checksums
+        self.final_url = url
+        self.segments = segments
+        self.target = target
+        if directory:
+            self.target = os.path.join(directory, os.path.basename(target))
+
+
+    def download(self, sink=None):
+        """Download the build"""
+
+        folder = os.path.dirname(self.target)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        scraper.download_file(self.final_url, self.target, self.segments,
+                              self.checksums, sink)
+
+
+    def resolve(self):
+        """The build has already been resolved"""
+
+        return self
+
+
+class BuildMatrix(object):
+    """Class to download or resolve a list of builds concurrently.
+
+    Each build is processed by one of the workers. The number of connections
+    to each host, including all segments of downloads, is limited by
+    connections_per_host via the shared connection pool.
+    A failure of a single build is recorded in its result and does not abort
+    the processing of the remaining builds.
+    """
+
+    def __init__(self, workers=1,
+                 connections_per_host=transfer.DEFAULT_SEGMENTS):
+        self.builds = [ ]
+        self.workers = max(1, int(workers))
+        self.connections_per_host = max(1, int(connections_per_host))
+        http_pool.pool.max_per_host = self.connections_per_host
+
+
+    def add(self, scraper_class, **kwargs):
+        """Add a build given by the scraper class and its keyword arguments"""
+
+        self.builds.append((scraper_class, kwargs))
+
+
+    def add_manifest(self, filename, directory=None,
+                     segments=transfer.DEFAULT_SEGMENTS):
+        """Add all successfully resolved builds of a manifest file"""
+
+        for build in JSONFile(filename).read()['builds']:
+            if build['status'] != 'passed':
+                continue
+
+            kwargs = dict([(str(key), value) for (key, value) in build.items()
+                           if key in ('application', 'checksums', 'locale',
+                                      'platform', 'target', 'url', 'version')])
+            self.add(ManifestBuild, directory=directory, segments=segments,
+                     **kwargs)
+
+
+    def download(self):
+        """Download all builds and return the list of results"""
+
+        return self.process(self.download_build)
+
+
+    def download_build(self, build, result):
+        """Download a single build and update its result"""
+
+        build.download()
+        result['target'] = build.target
+        result['url'] = build.final_url
+
+
+    def install(self, directory):
+        """Download all builds and install each of them into a sub folder of
+           the directory while it is being downloaded"""
+
+        return self.process(lambda build, result:
+                                self.install_build(build, result, directory))
+
+
+    def install_build(self, build, result, directory):
+        """Download and install a single build and update its result"""
+
+        name = os.path.basename(build.target)
+        for extension in ('.tar.bz2', '.exe', '.dmg'):
+            if name.endswith(extension):
+                name = name[:-len(extension)]
+
+        result['folder'] = install.Installer().install_build(
+                               build, os.path.join(directory, name))
+        result['target'] = build.target
+        result['url'] = build.final_url
+
+
+    def resolve(self):
+        """Resolve the final URLs of all builds without downloading them"""
+
+        return self.process(self.resolve_build)
+
+
+    def resolve_build(self, build, result):
+        """Resolve the final URL, target and size of a single build"""
+
+        build.resolve()
+        result['url'] = build.final_url
+        result['target'] = build.target
+        result['resolve_duration'] = time.time() - result['start_time']
+        result['checksums'] = build.checksums
+
+        response = http_pool.urlopen(build.final_url, method='HEAD')
+        length = response.getheader('Content-Length')
+        result['size'] = int(length) if length is not None else None
+
+
+    def process(self, action):
+        """Call the action for each build and return the results in the
+           order the builds have been added."""
+
+        queue = Queue.Queue()
+        for index, (scraper_class, kwargs) in enumerate(self.builds):
+            queue.put((index, scraper_class, kwargs))
+
+        results = [None] * len(self.builds)
+
+        def worker():
+            while True:
+                try:
+                    (index, scraper_class, kwargs) = queue.get_nowait()
+                except Queue.Empty:
+                    return
+
+                results[index] = self.process_build(scraper_class, kwargs,
+                                                    action)
+
+        threads = [ ]
+        for i in range(min(self.workers, len(self.builds))):
+            thread = threading.Thread(target=worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            # Join with a timeout so a KeyboardInterrupt still gets delivered
+            while thread.is_alive():
+                thread.join(1)
+
+        return results
+
+
+    def process_build(self, scraper_class, kwargs, action):
+        """Instantiate the scraper for a build and call the action for it"""
+
+        result = {'application': kwargs.get('application'),
+                  'locale': kwargs.get('locale'),
+                  'platform': kwargs.get('platform'),
+                  'version': kwargs.get('version'),
+                  'type': scraper_class.__name__,
+                  'url': None,
+                  'target': None,
+                  'error': None,
+                  'start_time': time.time()}
+
+        try:
+            build = scraper_class(**kwargs)
+            action(build, result)
+            result['status'] = 'passed'
+        except Exception, e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        result['duration'] = time.time() - result['start_time']
+
+        return result
+
+
+def add_options(parser):
+    """Add the options for caches, connections, metrics and mirrors which are
+       shared by the download scripts"""
+
+    parser.add_option('--base-url',
+                      dest='base_url',
+                      default=scraper.BASE_URL,
+                      metavar='URL',
+                      help='Base URL of the build server, can be a file:// URL '
+                           'of a local mirror, default: %s' % scraper.BASE_URL)
+    parser.add_option('--build-cache',
+                      dest='build_cache',
+                      default=None,
+                      metavar='DIRECTORY',
+                      help='Directory of the build cache shared by all scripts')
+    parser.add_option('--build-cache-size',
+                      dest='build_cache_size',
+                      default=build_cache.DEFAULT_MAX_SIZE / 1024 / 1024,
+                      type='int',
+                      metavar='MEGABYTES',
+                      help='Maximum size of the build cache, default: %d MB' %
+                           (build_cache.DEFAULT_MAX_SIZE / 1024 / 1024))
+    parser.add_option('--connections-per-host',
+                      dest='connections_per_host',
+                      default=None,
+                      type='int',
+                      metavar='CONNECTIONS',
+                      help='Maximum number of concurrent connections to a '
+                           'single host, including all segments of downloads, '
+                           'default: number of segments per download')
+    parser.add_option('--jobs', '-j',
+                      dest='jobs',
+                      default=1,
+                      type='int',
+                      metavar='JOBS',
+                      help='Number of builds to process concurrently, '
+                           'default: 1')
+    parser.add_option('--listing-cache',
+                      dest='listing_cache',
+                      default=None,
+                      metavar='DIRECTORY',
+                      help='Directory to cache parsed directory listings in')
+    parser.add_option('--listing-cache-ttl',
+                      dest='listing_cache_ttl',
+                      default=listing_cache.DEFAULT_TTL,
+                      type='int',
+                      metavar='SECONDS',
+                      help='Seconds until a cached listing gets revalidated, '
+                           'default: %d' % listing_cache.DEFAULT_TTL)
+    parser.add_option('--metrics-file',
+                      dest='metrics_file',
+                      default=None,
+                      metavar='PATH',
+                      help='Append timings of all download phases as JSON '
+                           'lines to the given file')
+    parser.add_option('--mirror',
+                      dest='mirrors',
+                      action='append',
+                      default=[ ],
+                      metavar='URL',
+                      help='Base URL of a mirror of the build server, can be '
+                           'specified multiple times')
+    parser.add_option('--resolve-only',
+                      dest='manifest',
+                      default=None,
+                      metavar='MANIFEST',
+                      help='Only resolve the builds and write their final URLs '
+                           'into the given JSON manifest')
+
+
+def create_matrix(options):
+    """Set up the base URL, caches, metrics, and mirrors of the scraper as
+       given by the shared options and return an empty matrix"""
+
+    scraper.BASE_URL = options.base_url.rstrip('/')
+    if options.build_cache:
+        max_size = options.build_cache_size * 1024 * 1024
+        scraper.build_cache = build_cache.BuildCache(options.build_cache, max_size)
+    if options.listing_cache:
+        scraper.listing_cache = listing_cache.ListingCache(options.listing_cache,
+                                                           options.listing_cache_ttl)
+    if options.metrics_file:
+        metrics.open_file(options.metrics_file)
+    if options.mirrors:
+        scraper.mirrors = mirrors.MirrorList([scraper.BASE_URL] + options.mirrors)
+
+    segments = getattr(options, 'segments', transfer.DEFAULT_SEGMENTS)
+    connections = options.connections_per_host or segments
+    if connections < segments:
+        print 'Warning: Only %d connections per host are allowed for ' \
+              'downloads with %d segments' % (connections, segments)
+
+    return BuildMatrix(options.jobs, connections)
+
+
+def print_results(results):
+    """Print a summary line for each processed build"""
+
+    print '\nResults:\n========'
+    for result in results:
+        line = '%(status)s: %(application)s %(version)s %(platform)s %(locale)s' \
+               ' (%(duration).1fs)' % result
+        if result['error']:
+            line += ' - %s' % result['error']
+        print line
+
+
+def print_statistics():
+    """Print the statistics of connections, predicted build names, and
+       mirrors"""
+
+    print 'Connections opened: %(opened)d, reused: %(reused)d' % \
+          http_pool.pool.stats()
+    if sum(scraper.prediction_stats.values()):
+        print 'Predicted build names: %(hits)d hits, %(misses)d misses' % \
+              scraper.prediction_stats
+    if scraper.mirrors is not None:
+        for (url, stats) in sorted(scraper.mirrors.stats().items()):
+            print 'Mirror %s: %d failures, %d bytes transferred' % \
+                  (url, stats['failures'], stats['transferred'])
+
+
+def write_manifest(filename, results):
+    """Write the results of resolved builds into a JSON manifest"""
+
+    JSONFile(filename).write({'base_url': scraper.BASE_URL,
+                              'created': time.time(),
+                              'builds': results})
+    print 'Manifest with %d builds written to %s' % (len(results), filename)
@@ -0,0 +1,84 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module to collect timings of the phases of build downloads.
+
+Each measurement is a dictionary with the phase, the URL, the time it has
+been recorded at, the duration in seconds and details of the phase:
+
+  listing     complete retrieval of a directory listing, incl. parse time
+  parse       time spent to extract the entries of a listing
+  match       search for the build in the entries of a listing
+  connect     establishment of a new connection to a server
+  first_byte  time from sending a request until the response arrived
+  redirect    a followed redirect
+  transfer    download of a file with its size and throughput
+  install     time a test-run waited for the installation of a build, and
+              if the install pool had it ready
+
+Measurements are passed to all registered callbacks and can be appended
+to a file with one JSON object per line.
+"""
+
+
+import json
+import threading
+import time
+
+
+# Callables which get each measurement
+callbacks = [ ]
+
+_file = None
+_lock = threading.Lock()
+
+
+def add_callback(callback):
+    """Register a callable which gets each measurement"""
+
+    callbacks.append(callback)
+
+
+def enabled():
+    """Return if measurements are collected at all"""
+
+    return bool(callbacks) or _file is not None
+
+
+def open_file(filename):
+    """Append all following measurements to the given JSON lines file"""
+
+    global _file
+
+    _lock.acquire()
+    try:
+        if _file is not None:
+            _file.close()
+        _file = open(filename, 'a')
+    finally:
+        _lock.release()
+
+
+def record(phase, url, duration, **details):
+    """Pass a measurement to the callbacks and the metrics file"""
+
+    if not enabled():
+        return
+
+    data = {'phase': phase,
+            'url': url,
+            'time': time.time(),
+            'duration': duration}
+    data.update(details)
+
+    for callback in callbacks:
+        callback(data)
+
+    _lock.acquire()
+    try:
+        if _file is not None:
+            _file.write(json.dumps(data) + '\n')
+            _file.flush()
+    finally:
+        _lock.release()
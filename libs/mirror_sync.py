@@ -0,0 +1,195 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module to keep a local mirror of selected builds of the build server."""
+
+
+from datetime import datetime, timedelta
+import os
+import re
+import shutil
+import threading
+import urllib
+
+import http_pool
+from json_file import JSONFile
+from listing_cache import IMMUTABLE_PATHS
+import scraper
+import transfer
+
+
+class MirrorSync(object):
+    """Class to copy builds of the build server into a local folder.
+
+    The folder keeps the layout of the server, so it can be used as BASE_URL
+    via a file:// URL or a local HTTP server. Only new or changed files are
+    transferred. The size and validators of each mirrored file are stored in
+    a state file. Files of immutable paths are never checked again once they
+    have been mirrored, all others are compared via a HEAD request.
+    """
+
+    def __init__(self, directory, base_url=None,
+                 segments=transfer.DEFAULT_SEGMENTS):
+        self.directory = os.path.abspath(directory)
+        self.base_url = (base_url or scraper.BASE_URL).rstrip('/')
+        self.segments = segments
+
+        self.immutable_paths = [re.compile(path) for path in IMMUTABLE_PATHS]
+        self.stats = {'transferred': 0, 'unchanged': 0, 'removed': 0}
+
+        self._lock = threading.Lock()
+        self._synced = set()
+        self._state_file = JSONFile(os.path.join(self.directory,
+                                                 '.mirror-state.json'))
+        try:
+            self.state = self._state_file.read()
+        except Exception:
+            self.state = { }
+
+
+    def count(self, key):
+        """Increment the given counter of the statistics"""
+
+        self._lock.acquire()
+        try:
+            self.stats[key] += 1
+        finally:
+            self._lock.release()
+
+
+    def is_immutable(self, url):
+        """Check if the file of the URL will never change"""
+
+        for pattern in self.immutable_paths:
+            if pattern.search(url):
+                return True
+        return False
+
+
+    def local_path(self, url):
+        """Return the path of the mirrored file of the URL"""
+
+        if not url.startswith(self.base_url + '/'):
+            raise ValueError('URL is not part of the mirror: %s' % url)
+
+        path = urllib.unquote(url[len(self.base_url) + 1:])
+        return os.path.join(self.directory, *path.split('/'))
+
+
+    def prune_daily_builds(self, application, days):
+        """Remove the folders of daily builds older than the given days"""
+
+        limit = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        nightly = os.path.join(self.directory, application, 'nightly')
+
+        for (root, folders, files) in os.walk(nightly):
+            for folder in list(folders):
+                match = re.match(r'(\d{4}-\d{2}-\d{2})-', folder)
+                if match and match.group(1) < limit:
+                    print 'Removing outdated daily build: %s' % folder
+                    shutil.rmtree(os.path.join(root, folder))
+                    folders.remove(folder)
+                    self.count('removed')
+
+        # Forget about files which are gone
+        self._lock.acquire()
+        try:
+            for url in self.state.keys():
+                if not os.path.isfile(self.local_path(url)):
+                    del self.state[url]
+        finally:
+            self._lock.release()
+
+
+    def save(self):
+        """Store the state of all mirrored files"""
+
+        self._lock.acquire()
+        try:
+            self._state_file.write(self.state)
+        finally:
+            self._lock.release()
+
+
+    def sync_build(self, build, result):
+        """Mirror the build and its checksums. Can be used as action of
+           BuildMatrix.process()."""
+
+        build.resolve()
+        result['url'] = build.final_url
+        result['target'] = self.sync_file(build.final_url)
+
+        urls = [ ]
+        checksums_url = build.checksums_url
+        if checksums_url:
+            urls.append(checksums_url)
+
+        # Daily builds without a date are found via the status files
+        if isinstance(build, scraper.DailyScraper):
+            url = '%s/nightly/latest-%s/' % (build.base_url, build.branch)
+            try:
+                parser = scraper.DirectoryParser(url)
+                urls.extend([url + entry for entry in
+                             parser.filter(r'.*%s\.txt' % build.platform_regex)])
+            except scraper.NotFoundException, e:
+                print str(e)
+
+        for url in urls:
+            try:
+                self.sync_file(url)
+            except http_pool.HTTPError, e:
+                print 'File cannot be mirrored: %s' % str(e)
+
+
+    def sync_file(self, url):
+        """Mirror the file of the URL if it is new or has been changed and
+           return its local path."""
+
+        path = self.local_path(url)
+
+        # Files like checksums are shared by many builds
+        self._lock.acquire()
+        try:
+            if url in self._synced:
+                return path
+            self._synced.add(url)
+            record = self.state.get(url)
+        finally:
+            self._lock.release()
+
+        exists = os.path.isfile(path)
+        if record and exists and self.is_immutable(url) and \
+           os.path.getsize(path) == record['size']:
+            self.count('unchanged')
+            return path
+
+        response = http_pool.urlopen(url, method='HEAD')
+        remote = {'size': int(response.getheader('Content-Length', -1)),
+                  'etag': response.getheader('ETag'),
+                  'last_modified': response.getheader('Last-Modified')}
+
+        if record == remote and exists and os.path.getsize(path) == remote['size']:
+            self.count('unchanged')
+            return path
+
+        print 'Mirroring file: %s' % urllib.unquote(url)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        tmp_file = path + '.part'
+        download = transfer.SegmentedDownload(url, tmp_file, self.segments)
+        download.download()
+        if exists:
+            os.remove(path)
+        os.rename(tmp_file, path)
+
+        self._lock.acquire()
+        try:
+            self.state[url] = remote
+        finally:
+            self._lock.release()
+        self.count('transferred')
+
+        return path
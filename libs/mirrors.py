@@ -0,0 +1,185 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module to choose between mirrors of the build server."""
+
+
+import Queue
+import threading
+import time
+
+import http_pool
+
+
+# Number of mirrors which are raced for the first bytes of a file
+RACE_COUNT = 3
+
+# Weight of a new measurement in the moving averages of the statistics
+SMOOTHING = 0.3
+
+
+class MirrorList(object):
+    """Class for an ordered list of base URLs which serve the same tree.
+
+    URLs below any of the base URLs can be mapped to all mirrors. Mirrors are
+    ranked by their failures and the measured throughput and latency, with
+    the given order as tie-breaker, so the statistics of earlier transfers
+    feed the choice of later ones.
+    """
+
+    def __init__(self, base_urls, race_count=RACE_COUNT):
+        self.base_urls = [url.rstrip('/') for url in base_urls]
+        self.race_count = max(1, int(race_count))
+
+        self._lock = threading.Lock()
+        self._stats = dict([(url, {'failures': 0,
+                                   'latency': None,
+                                   'throughput': None,
+                                   'transferred': 0})
+                            for url in self.base_urls])
+
+
+    def base_url(self, url):
+        """Return the mirror the URL belongs to or None"""
+
+        for base_url in self.base_urls:
+            if url == base_url or url.startswith(base_url + '/'):
+                return base_url
+        return None
+
+
+    def race(self, url, headers=None):
+        """Request the URL from the best ranked mirrors at the same time and
+           return the mirror URL and response of the fastest one. Slower
+           responses get closed once they arrive."""
+
+        urls = self.urls(url)[:self.race_count]
+        results = Queue.Queue()
+
+        def request(mirror_url):
+            start = time.time()
+            try:
+                response = http_pool.urlopen(mirror_url, headers)
+                results.put((mirror_url, response, None, time.time() - start))
+            except Exception, e:
+                results.put((mirror_url, None, e, None))
+
+        for mirror_url in urls:
+            thread = threading.Thread(target=request, args=(mirror_url, ))
+            thread.daemon = True
+            thread.start()
+
+        def close_remaining(count):
+            for i in range(count):
+                (mirror_url, response, error, latency) = results.get()
+                if error is not None:
+                    self.record_failure(mirror_url)
+                else:
+                    self.record_latency(mirror_url, latency)
+                    response.close()
+
+        errors = [ ]
+        for index in range(len(urls)):
+            (mirror_url, response, error, latency) = results.get()
+            if error is not None:
+                self.record_failure(mirror_url)
+                errors.append(error)
+                continue
+
+            self.record_latency(mirror_url, latency)
+
+            # Don't wait for the slower mirrors
+            thread = threading.Thread(target=close_remaining,
+                                      args=(len(urls) - index - 1, ))
+            thread.daemon = True
+            thread.start()
+
+            return (mirror_url, response)
+
+        raise errors[0]
+
+
+    def ranked(self):
+        """Return the base URLs with the best mirror first"""
+
+        self._lock.acquire()
+        try:
+            def score(base_url):
+                stats = self._stats[base_url]
+                return (stats['failures'],
+                        -(stats['throughput'] or 0),
+                        stats['latency'] or 0,
+                        self.base_urls.index(base_url))
+
+            return sorted(self.base_urls, key=score)
+        finally:
+            self._lock.release()
+
+
+    def record_failure(self, url):
+        """Count a failed request or transfer of the mirror"""
+
+        self._update(url, lambda stats: stats.update(
+                                            failures=stats['failures'] + 1))
+
+
+    def record_latency(self, url, seconds):
+        """Update the time until the mirror responded to a request"""
+
+        self._update(url, lambda stats: stats.update(
+                                            latency=average(stats['latency'],
+                                                            seconds)))
+
+
+    def record_transfer(self, url, size, seconds):
+        """Update the throughput of the mirror with a finished transfer"""
+
+        def update(stats):
+            stats['transferred'] += size
+            if seconds > 0:
+                stats['throughput'] = average(stats['throughput'],
+                                              size / seconds)
+        self._update(url, update)
+
+
+    def stats(self):
+        """Return the statistics of all mirrors keyed by base URL"""
+
+        self._lock.acquire()
+        try:
+            return dict([(url, stats.copy())
+                         for (url, stats) in self._stats.items()])
+        finally:
+            self._lock.release()
+
+
+    def urls(self, url):
+        """Return the URL on all mirrors with the best mirror first"""
+
+        base_url = self.base_url(url)
+        if base_url is None:
+            return [url]
+
+        path = url[len(base_url):]
+        return [mirror + path for mirror in self.ranked()]
+
+
+    def _update(self, url, update):
+        base_url = self.base_url(url)
+        if base_url is None:
+            return
+
+        self._lock.acquire()
+        try:
+            update(self._stats[base_url])
+        finally:
+            self._lock.release()
+
+
+def average(current, value):
+    """Return the exponential moving average with the new value"""
+
+    if current is None:
+        return value
+    return current + SMOOTHING * (value - current)
@@ -0,0 +1,117 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module to find the build which introduced a regression."""
+
+
+from json_file import JSONFile
+from scraper import NotFoundException
+
+
+class RegressionException(Exception):
+    """Exception for a range of builds which cannot be bisected"""
+
+
+class RegressionFinder(object):
+    """Class to find the first failing build via binary search.
+
+    The builds have to be ordered from old to new. The first build is expected
+    to pass the test and the last one to fail it. The test is a callable which
+    gets a build and returns True if the build passes, or None if the build
+    cannot be tested. Such builds are skipped like in git bisect, so the
+    result may leave untested builds between the good and the bad one.
+    Results are kept per build key and can be stored in a JSON file, so an
+    interrupted or repeated bisection doesn't test a build again.
+    """
+
+    def __init__(self, builds, test, results_file=None, key=None):
+        self.builds = list(builds)
+        self.key = key or (lambda build: build.final_url)
+        self.skipped = set()
+        self.test = test
+
+        self._results_file = JSONFile(results_file) if results_file else None
+        self.results = { }
+        if self._results_file:
+            try:
+                self.results = self._results_file.read()
+            except Exception:
+                pass
+
+
+    def find(self):
+        """Return the last passing and the first failing build"""
+
+        if len(self.builds) < 2:
+            raise RegressionException('At least two builds are needed')
+
+        good = 0
+        bad = len(self.builds) - 1
+        if self.passes(good) is not True:
+            raise RegressionException('The first build does not pass')
+        if self.passes(bad) is not False:
+            raise RegressionException('The last build does not fail')
+
+        while True:
+            middle = self.next_index(good, bad)
+            if middle is None:
+                break
+
+            remaining = bad - good - 1 - len([index for index in self.skipped
+                                              if good < index < bad])
+            print 'Remaining builds: %d, about %d steps left' % \
+                  (remaining, len(bin(remaining + 1)) - 3)
+
+            result = self.passes(middle)
+            if result is None:
+                self.skipped.add(middle)
+            elif result:
+                good = middle
+            else:
+                bad = middle
+
+        return (self.builds[good], self.builds[bad])
+
+
+    def next_index(self, good, bad):
+        """Return the index of the build which is closest to the middle of
+           the range and has not been skipped, or None if there is none"""
+
+        middle = (good + bad) / 2.0
+        candidates = [index for index in range(good + 1, bad)
+                      if index not in self.skipped]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda index: abs(index - middle))
+
+
+    def passes(self, index):
+        """Test the build at the given index, unless there is a result for
+           it already. Returns None if the build cannot be tested."""
+
+        build = self.builds[index]
+        try:
+            key = self.key(build)
+        except NotFoundException, e:
+            # E.g. a folder without a binary for the platform
+            print 'skipped: build %d of %d: %s' % (index + 1, len(self.builds),
+                                                   str(e))
+            return None
+
+        if key not in self.results:
+            print 'Testing build %d of %d: %s' % (index + 1, len(self.builds), key)
+            result = self.test(build)
+            if result is None:
+                # Don't store it, the build may be testable next time
+                print 'skipped: %s' % key
+                return None
+
+            self.results[key] = bool(result)
+            if self._results_file:
+                self._results_file.write(self.results)
+        else:
+            print 'Using previous result for build: %s' % key
+
+        print '%s: %s' % ('passed' if self.results[key] else 'failed', key)
+        return self.results[key]
@@ -37,19 +37,57 @@
 """Module to handle downloads for different types of Firefox and Thunderbird builds."""
 
 
+import bisect
+import calendar
 from datetime import datetime, tzinfo, timedelta
 from HTMLParser import HTMLParser
+import httplib
 import os
 import re
+import socket
 import sys
+import threading
+import time
 import urllib
 
+from build_cache import file_digest
+from file_lock import FileLock
+import http_pool
+from json_file import JSONFile
+import metrics
 import mozinfo
+import transfer
 
 
 # Base URL for the path to all builds
 BASE_URL = 'https://ftp.mozilla.org/pub/mozilla.org'
 
+# Size of the pieces a directory listing is read and parsed in
+LISTING_CHUNK_SIZE = 16 * 1024
+
+# Optional cache for parsed directory listings (see listing_cache.py)
+listing_cache = None
+
+# Optional machine-wide cache for downloaded builds (see build_cache.py)
+build_cache = None
+
+# Optional list of mirrors to transfer builds from (see mirrors.py)
+mirrors = None
+
+# Seconds complete listings are shared between scrapers of the same process
+SHARED_LISTING_TTL = 60
+
+# Seconds a path which has not been found is not requested again
+MISSING_PATH_TTL = 120
+
+# Counters of the predicted filenames of release builds
+prediction_stats = {'hits': 0, 'misses': 0}
+_prediction_lock = threading.Lock()
+
+# Parsed checksums files keyed by their URL
+_checksums = { }
+_checksums_lock = threading.Lock()
+
 PLATFORM_FRAGMENTS = {'linux': 'linux-i686',
                       'linux64': 'linux-x86_64',
                       'mac': 'mac',
@@ -65,21 +103,198 @@ class NotFoundException(Exception):
         Exception.__init__(self, ': '.join([message, location]))
 
 
-class DirectoryParser(HTMLParser):
-    """Class to parse directory listings"""
+class ChecksumMismatchException(Exception):
+    """Exception for a build whose content doesn't match its checksum"""
+    def __init__(self, algorithm, location):
+        self.location = location
+        message = 'Checksum (%s) does not match' % algorithm
+        Exception.__init__(self, ': '.join([message, location]))
+
+
+def download_file(url, target, segments=transfer.DEFAULT_SEGMENTS,
+                  checksums=None, sink=None):
+    """Download the build from the URL unless the target already exists.
+       If checksums (algorithm => hex digest) are given the content of the
+       build gets verified. A sink gets the content of the build in order,
+       while it is being downloaded or from the existing file.
+
+       The target is guarded by a lock file, so only one process or thread
+       downloads it. Everyone else waits and reuses the finished file."""
+
+    lock = FileLock(target + '.lock')
+    if not lock.acquire(blocking=False):
+        print 'Waiting for the download of the build by another process: %s' % \
+              target
+        lock.acquire()
+
+    tmp_file = None
+    download = None
+
+    try:
+        # Don't re-download the build
+        if os.path.isfile(os.path.abspath(target)):
+            print "Build has already been downloaded: %s" % (target)
+            if verify_existing_file(target, checksums):
+                feed_sink(target, sink)
+                return
+
+        if build_cache is not None:
+            digest = build_cache.materialize(url, target)
+            if digest:
+                print "Build has been taken from the cache: %s" % (target)
+                JSONFile(target + '.digests').write({'sha512': digest})
+                if verify_existing_file(target, checksums):
+                    feed_sink(target, sink)
+                    return
+                build_cache.discard(url)
+
+        print 'Downloading build: %s' % (urllib.unquote(url))
+        tmp_file = target + ".part"
+
+        # The digest for the build cache is always needed
+        algorithms = set(['sha512'] + (checksums or { }).keys())
+        download = transfer.SegmentedDownload(url, tmp_file, segments,
+                                              algorithms=list(algorithms),
+                                              mirrors=mirrors, sink=sink)
+        download.download()
+
+        digests = download.hexdigests()
+        verify_checksums(url, checksums, digests)
+        JSONFile(target + '.digests').write(digests)
+        os.rename(tmp_file, target)
+
+        if build_cache is not None:
+            build_cache.add(url, target, digests['sha512'])
+    except:
+        # Keep partial downloads which can be resumed by the next attempt.
+        # A handled exception would replace the one to re-raise in Python 2.
+        if tmp_file and not (download and download.resumable) and \
+           os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+
+        raise
+    finally:
+        lock.release()
+
+
+def feed_sink(filename, sink, chunk_size=transfer.CHUNK_SIZE):
+    """Pass the content of the file to the sink"""
+
+    if sink is None:
+        return
+
+    f = open(filename, 'rb')
+    try:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            sink.write(data)
+    finally:
+        f.close()
+
+
+def get_checksums(url):
+    """Return the parsed checksums file of the given URL. Each file is only
+       retrieved once."""
+
+    _checksums_lock.acquire()
+    try:
+        if url not in _checksums:
+            if url in missing_paths:
+                raise NotFoundException('Checksums cannot be found', url)
+
+            print 'Retrieving checksums from %s' % url
+            algorithm = os.path.basename(url).replace('SUMS', '').lower()
+            try:
+                data = http_pool.urlopen(url).read()
+            except http_pool.HTTPError, e:
+                if e.code == 404:
+                    missing_paths.add(url)
+                    raise NotFoundException('Checksums cannot be found', url)
+                raise
+            _checksums[url] = parse_checksums(data, algorithm)
+        return _checksums[url]
+    finally:
+        _checksums_lock.release()
+
+
+def parse_checksums(data, algorithm=None):
+    """Parse the content of a checksums file and return a dictionary of
+       filename => (algorithm => hex digest). Supported are files in the
+       format of sha512sum, and the .checksums files of nightly builds which
+       also contain the algorithm and size of each file."""
+
+    checksums = { }
+    for line in data.splitlines():
+        match = re.match(r'^([0-9a-f]+)\s+(md5|sha\d+)\s+\d+\s+(.+)$', line.strip())
+        if match:
+            (digest, name, filename) = match.groups()
+        else:
+            match = re.match(r'^([0-9a-f]+)\s+\*?(.+)$', line.strip())
+            if not match or not algorithm:
+                continue
+            (digest, filename) = match.groups()
+            name = algorithm
+
+        checksums.setdefault(filename, { })[name] = digest
+    return checksums
+
+
+def verify_checksums(location, checksums, digests):
+    """Compare the expected checksums with the computed digests"""
+
+    for (algorithm, digest) in (checksums or { }).items():
+        if digests.get(algorithm, '').lower() != digest.lower():
+            raise ChecksumMismatchException(algorithm, location)
+
+
+def verify_existing_file(filename, checksums):
+    """Verify the checksums of an existing file. If they don't match, the
+       file and its digests get removed and False is returned."""
+
+    try:
+        verify_file(filename, checksums)
+        return True
+    except ChecksumMismatchException, e:
+        print 'Removing build with a wrong checksum: %s' % str(e)
+        for path in (filename, filename + '.digests'):
+            if os.path.isfile(path):
+                os.remove(path)
+        return False
+
+
+def verify_file(filename, checksums):
+    """Verify the checksums of an existing file. Digests stored in the sidecar
+       of the file are trusted, missing ones get computed and stored."""
+
+    if not checksums:
+        return
+
+    digests_file = JSONFile(filename + '.digests')
+    try:
+        digests = digests_file.read()
+    except Exception:
+        digests = { }
+
+    missing = [algorithm for algorithm in checksums if algorithm not in digests]
+    if missing:
+        for algorithm in missing:
+            digests[algorithm] = file_digest(filename, algorithm)
+        digests_file.write(digests)
 
-    def __init__(self, url):
+    verify_checksums(filename, checksums, digests)
+
+
+class HTMLListingParser(HTMLParser):
+    """Class to extract the entries of a directory listing via HTMLParser"""
+
+    def __init__(self):
         HTMLParser.__init__(self)
 
         self.entries = [ ]
         self.active_url = None
-
-        req = urllib.urlopen(url)
-        self.feed(req.read())
-
-    def filter(self, regex):
-        pattern = re.compile(regex, re.IGNORECASE)
-        return [entry for entry in self.entries if pattern.match(entry)]
+        self.active_data = [ ]
 
     def handle_starttag(self, tag, attrs):
         if not tag == 'a':
@@ -88,28 +303,378 @@ class DirectoryParser(HTMLParser):
         for attr in attrs:
             if attr[0] == 'href':
                 self.active_url = attr[1].strip('/')
+                self.active_data = [ ]
                 return
 
 
     def handle_endtag(self, tag):
-        if tag == 'a':
-            self.active_url = None
+        if not tag == 'a' or not self.active_url:
+            return
+
+        # The data of a link can arrive in pieces when the listing is streamed
+        name = urllib.quote(''.join(self.active_data).strip('/'))
+        if self.active_url == name:
+            self.entries.append(self.active_url)
+
+        self.active_url = None
 
     def handle_data(self, data):
         # Only process the data when we are in an active a tag and have an URL
         if not self.active_url:
             return
 
-        name = urllib.quote(data.strip('/'))
-        if self.active_url == name:
-            self.entries.append(self.active_url)
+        self.active_data.append(data)
+
+
+class RegexListingParser(object):
+    """Class to extract the entries of a directory listing via a regular
+    expression, which is a lot faster than HTMLParser for the index formats
+    of Apache and nginx. Once a link is found which the expression does not
+    match, e.g. because its text is wrapped in tags, the whole listing is
+    parsed by HTMLListingParser instead.
+    """
+
+    anchor_regex = re.compile(r'<a\s', re.IGNORECASE)
+
+    link_regex = re.compile(r'<a\s[^>]*?href\s*=\s*'
+                            r'(?:"(?P<dq>[^"]*)"|\'(?P<sq>[^\']*)\'|(?P<uq>[^\s>]+))'
+                            r'[^>]*>(?P<name>[^<]*)</a\s*>', re.IGNORECASE)
+
+    def __init__(self):
+        self.entries = [ ]
+
+        self._buffer = ''
+        self._fallback = None
+
+        # Data has to be kept in case the listing has to be parsed again
+        self._history = [ ]
+
+    def close(self):
+        """Finish parsing"""
+
+        if self._fallback is not None:
+            self._fallback.close()
+            self._sync_fallback()
+
+        self._buffer = ''
+        self._history = None
+
+    def feed(self, data):
+        """Extract the entries of all links which are completely contained
+           in the data fed so far."""
+
+        if self._fallback is not None:
+            self._fallback.feed(data)
+            self._sync_fallback()
+            return
+
+        self._history.append(data)
+
+        data = self._buffer + data
+        entries = [ ]
+        end = 0
+        for match in self.link_regex.finditer(data):
+            if self.anchor_regex.search(data, end, match.start()):
+                break
+
+            url = (match.group('dq') or match.group('sq') or
+                   match.group('uq') or '').strip('/')
+            if url == urllib.quote(match.group('name').strip('/')):
+                entries.append(url)
+            end = match.end()
+        else:
+            # Keep an incomplete link for the next piece of data
+            index = data.lower().rfind('<a', end)
+            if not self.anchor_regex.search(data, end,
+                                            index if index >= 0 else len(data)):
+                self.entries.extend(entries)
+                self._buffer = data[index:] if index >= 0 else data[-1:]
+                return
+
+        # A link has not been matched, so parse everything via HTMLParser.
+        # The entries found so far are the start of its entries.
+        self._fallback = HTMLListingParser()
+        for data in self._history:
+            self._fallback.feed(data)
+        self._sync_fallback()
+
+        self._buffer = ''
+        self._history = None
+
+    def _sync_fallback(self):
+        self.entries.extend(self._fallback.entries[len(self.entries):])
+
+
+class MissingPaths(object):
+    """Class to remember paths on the server which have not been found, so
+    other scrapers of the process don't have to request them again. Entries
+    expire after the TTL because builds get published over time."""
+
+    def __init__(self, ttl=MISSING_PATH_TTL):
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._paths = { }
+
+
+    def __contains__(self, url):
+        # Everything below a missing folder is missing too
+        parts = url.rstrip('/').split('/')
+        urls = ['/'.join(parts[:index]) for index in range(len(parts), 3, -1)]
+
+        self._lock.acquire()
+        try:
+            for url in urls:
+                if url not in self._paths:
+                    continue
+                if time.time() - self._paths[url] < self.ttl:
+                    return True
+                del self._paths[url]
+            return False
+        finally:
+            self._lock.release()
+
+
+    def add(self, url):
+        """Remember that the URL has not been found"""
+
+        self._lock.acquire()
+        try:
+            self._paths[url.rstrip('/')] = time.time()
+        finally:
+            self._lock.release()
+
+
+    def clear(self):
+        """Forget all missing paths"""
+
+        self._lock.acquire()
+        try:
+            self._paths.clear()
+        finally:
+            self._lock.release()
+
+
+class SharedListings(object):
+    """Class to share the entries of complete directory listings between all
+    scrapers of a process.
+
+    Resolving many builds at once retrieves the same listings over and over,
+    e.g. the builds of a month or the build folders of a candidate. The first
+    scraper which asks for a listing fetches it. Scrapers which ask for the
+    same listing in the meantime wait for that fetch instead of starting their
+    own, and get its entries or its exception.
+    """
+
+    def __init__(self, ttl=SHARED_LISTING_TTL):
+        self.ttl = ttl
+
+        self._listings = { }
+        self._lock = threading.Lock()
+        self._pending = { }
+
+
+    def clear(self):
+        """Forget all shared listings"""
+
+        self._lock.acquire()
+        try:
+            self._listings.clear()
+        finally:
+            self._lock.release()
+
+
+    def lookup(self, url):
+        """Return the entries of the listing if they are known, otherwise None"""
+
+        self._lock.acquire()
+        try:
+            if url in self._listings:
+                (timestamp, entries) = self._listings[url]
+                if time.time() - timestamp < self.ttl:
+                    return list(entries)
+            return None
+        finally:
+            self._lock.release()
+
+
+    def get(self, url, fetch):
+        """Return the entries of the listing. If it is not known yet the entries
+           are retrieved by calling fetch."""
+
+        self._lock.acquire()
+        try:
+            if url in self._listings:
+                (timestamp, entries) = self._listings[url]
+                if time.time() - timestamp < self.ttl:
+                    return list(entries)
+                del self._listings[url]
+
+            flight = self._pending.get(url)
+            if flight is None:
+                flight = self._pending[url] = {'event': threading.Event(),
+                                               'entries': None,
+                                               'error': None}
+                owner = True
+            else:
+                owner = False
+        finally:
+            self._lock.release()
+
+        if not owner:
+            flight['event'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return list(flight['entries'])
+
+        try:
+            try:
+                flight['entries'] = fetch()
+            except Exception, e:
+                flight['error'] = e
+                raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._pending[url]
+                if flight['error'] is None:
+                    self._listings[url] = (time.time(), flight['entries'])
+            finally:
+                self._lock.release()
+            flight['event'].set()
+
+        return list(flight['entries'])
+
+
+class DirectoryParser(object):
+    """Class to parse directory listings.
+
+    By default the complete listing is retrieved and parsed when the parser
+    gets created. In stream mode nothing is fetched until iter_entries() is
+    called, which yields the entries while the listing is still downloading.
+    Complete listings are shared with all other parsers of the process via
+    shared_listings. The backend which extracts the entries can be selected
+    by its name in PARSER_BACKENDS.
+    """
+
+    def __init__(self, url, stream=False, backend=None):
+        self.url = url
+        self.backend = backend or LISTING_PARSER
+        self.entries = [ ]
+
+        if not stream:
+            self.entries = shared_listings.get(url, self.read_entries)
+
+    def filter(self, regex):
+        pattern = re.compile(regex, re.IGNORECASE)
+        return [entry for entry in self.entries if pattern.match(entry)]
+
+    def read_entries(self):
+        """Retrieve the complete listing and return its entries"""
+
+        for entry in self.iter_entries():
+            pass
+        return self.entries
+
+    def iter_entries(self):
+        """Yield the entries of the listing as soon as they have been parsed.
+           If the generator is closed early the connection gets closed too."""
+
+        start = time.time()
+        record = None
+        headers = { }
+        if listing_cache is not None:
+            record = listing_cache.lookup(self.url)
+            if record is not None:
+                if listing_cache.is_fresh(self.url, record):
+                    self.entries = record['entries']
+                    metrics.record('listing', self.url, time.time() - start,
+                                   source='cache', entries=len(self.entries))
+                    for entry in self.entries:
+                        yield entry
+                    return
+                headers = listing_cache.validators(record)
+
+        if self.url in missing_paths:
+            raise NotFoundException('Folder cannot be found', self.url)
+
+        try:
+            req = http_pool.urlopen(self.url, headers)
+        except http_pool.HTTPError, e:
+            if e.code == 404:
+                missing_paths.add(self.url)
+                raise NotFoundException('Folder cannot be found', self.url)
+            raise
+
+        size = 0
+        parse_time = 0
+        complete = False
+        try:
+            if req.getcode() == 304:
+                # The cached listing is still valid
+                req.read()
+                self.entries = record['entries']
+                complete = True
+                for entry in self.entries:
+                    yield entry
+            else:
+                parser = PARSER_BACKENDS[self.backend]()
+                self.entries = parser.entries
+
+                index = 0
+                while True:
+                    data = req.read(LISTING_CHUNK_SIZE)
+                    size += len(data)
+
+                    parse_start = time.time()
+                    if data:
+                        parser.feed(data)
+                    else:
+                        parser.close()
+                        complete = True
+                    parse_time += time.time() - parse_start
+
+                    while index < len(self.entries):
+                        yield self.entries[index]
+                        index += 1
+
+                    if not data:
+                        break
+        finally:
+            req.close()
+
+            if metrics.enabled():
+                source = 'revalidated' if req.getcode() == 304 else 'server'
+                metrics.record('listing', self.url, time.time() - start,
+                               source=source, bytes=size, complete=complete,
+                               entries=len(self.entries))
+                if source == 'server':
+                    metrics.record('parse', self.url, parse_time,
+                                   backend=self.backend, bytes=size,
+                                   entries=len(self.entries))
+
+        if listing_cache is not None:
+            listing_cache.store(self.url, self.entries,
+                                req.getheader('ETag'),
+                                req.getheader('Last-Modified'))
+
+
+# Available backends to extract the entries of directory listings
+PARSER_BACKENDS = {'html': HTMLListingParser,
+                   'regex': RegexListingParser}
+
+LISTING_PARSER = 'regex'
+
+missing_paths = MissingPaths()
+shared_listings = SharedListings()
 
 
 class MozillaScraper(object):
     """Generic class to download an application from the Mozilla server"""
 
     def __init__(self, directory, version, platform=None,
-                 application='firefox', locale='en-US'):
+                 application='firefox', locale='en-US',
+                 segments=transfer.DEFAULT_SEGMENTS):
 
         # Private properties for caching
         self._target = None
@@ -118,6 +683,7 @@ class MozillaScraper(object):
         self.directory = directory
         self.locale = locale
         self.platform = platform or self.detect_platform()
+        self.segments = segments
         self.version = version
 
         # build the base URL
@@ -130,20 +696,36 @@ class MozillaScraper(object):
         """Return the name of the build"""
 
         if self._binary is None:
-            # Retrieve all entries from the remote virtual folder
-            parser = DirectoryParser(self.path)
+            pattern = re.compile(self.binary_regex, re.IGNORECASE)
+
+            # Use the listing if it has already been retrieved completely,
+            # otherwise stream the entries from the remote virtual folder
+            # and stop reading the listing once the first entry matches
+            parser = DirectoryParser(self.path, stream=True)
+            parser.entries = shared_listings.lookup(self.path) or [ ]
+            if parser.entries:
+                entries = (entry for entry in parser.entries)
+            else:
+                entries = parser.iter_entries()
+
+            match_time = 0
+            try:
+                for entry in entries:
+                    match_start = time.time()
+                    match = pattern.match(entry)
+                    match_time += time.time() - match_start
+                    if match:
+                        self._binary = match.group()
+                        break
+            finally:
+                entries.close()
+
+            metrics.record('match', self.path, match_time,
+                           entries=len(parser.entries),
+                           found=self._binary is not None)
+
             if not parser.entries:
                 raise NotFoundException('No entries found', self.path)
-    
-            # Download the first matched directory entry
-            pattern = re.compile(self.binary_regex, re.IGNORECASE)
-            for entry in parser.entries:
-                try:
-                    self._binary = pattern.match(entry).group()
-                    break
-                except:
-                    # No match, continue with next entry
-                    continue
 
         if self._binary is None:
             raise NotFoundException("Binary not found in folder", self.path)
@@ -158,6 +740,37 @@ class MozillaScraper(object):
         raise NotImplementedError(sys._getframe(0).f_code.co_name)
 
 
+    @property
+    def checksums(self):
+        """Return the published checksums of the build (algorithm => hex
+           digest) or None if they are not available"""
+
+        if self.checksums_url is None:
+            return None
+
+        try:
+            checksums = get_checksums(self.checksums_url)
+        except Exception, e:
+            print 'Checksums cannot be retrieved: %s' % str(e)
+            return None
+
+        return checksums.get(self.checksums_key)
+
+
+    @property
+    def checksums_key(self):
+        """Return the filename of the build in the checksums file"""
+
+        return urllib.unquote(self.binary)
+
+
+    @property
+    def checksums_url(self):
+        """Return the URL of the checksums file of the build"""
+
+        return None
+
+
     @property
     def extension(self):
         """Return the file extension"""
@@ -225,43 +838,38 @@ class MozillaScraper(object):
             return "%s%d" % (mozinfo.os, mozinfo.bits)
 
 
-    def download(self):
-        """Download the specified file"""
-
-        tmp_file = None
+    def download(self, sink=None):
+        """Download the specified file. The optional sink gets its content
+           while it is being downloaded."""
 
         if not os.path.isdir(self.directory):
             os.makedirs(self.directory)
 
-        try:
-            # Don't re-download the build
-            if os.path.isfile(os.path.abspath(self.target)):
-                print "Build has already been downloaded: %s" % (self.target)
-                return
+        download_file(self.final_url, self.target, self.segments,
+                      self.checksums, sink)
 
-            print 'Downloading build: %s' % (urllib.unquote(self.final_url))
-            tmp_file = self.target + ".part"
-            urllib.urlretrieve(self.final_url, tmp_file)
-            os.rename(tmp_file, self.target)
-        except:
-            try:
-                if tmp_file:
-                    os.remove(tmp_file)
-            except OSError:
-                pass
 
-            raise
+    def resolve(self):
+        """Retrieve everything which is needed to download the build, so no
+           further requests happen when its properties are accessed."""
+
+        self.final_url
+        self.target
+        return self
 
 
 class DailyScraper(MozillaScraper):
     """Class to download a daily build from the Mozilla server"""
 
     def __init__(self, branch='mozilla-central', build_id=None, date=None,
-                 build_number=None, *args, **kwargs):
+                 build_number=None, monthly_builds=None, *args, **kwargs):
 
         MozillaScraper.__init__(self, *args, **kwargs)
         self.branch = branch
 
+        # Entries of the monthly listing if it has already been retrieved
+        self.monthly_builds = monthly_builds
+
         # Internally we access builds via index
         if build_number is not None:
             self.build_index = int(build_number) - 1
@@ -295,16 +903,22 @@ class DailyScraper(MozillaScraper):
 
             # Read status file for the platform, retrieve build id, and convert to a date
             status_file = url + parser.entries[0]
-            f = urllib.urlopen(status_file)
-            self.date = datetime.strptime(f.readline().strip(), '%Y%m%d%H%M%S')
+            f = http_pool.urlopen(status_file)
+            build_id = f.read().splitlines()[0].strip()
+            self.date = datetime.strptime(build_id, '%Y%m%d%H%M%S')
             self.builds, self.build_index = self.get_build_info_for_date(self.date)
 
 
     def get_build_info_for_date(self, date, build_index=None):
         url = '/'.join([self.base_url, self.monthly_build_list_regex])
 
-        print 'Retrieving list of builds from %s' % url
-        parser = DirectoryParser(url)
+        if self.monthly_builds is None:
+            print 'Retrieving list of builds from %s' % url
+            parser = DirectoryParser(url)
+        else:
+            parser = DirectoryParser(url, stream=True)
+            parser.entries = self.monthly_builds
+
         regex = r'%(DATE)s-(\d+-)+%(BRANCH)s%(L10N)s$' % {
                     'DATE': date.strftime('%Y-%m-%d'),
                     'BRANCH': self.branch,
@@ -344,6 +958,16 @@ class DailyScraper(MozillaScraper):
                         'PLATFORM': self.platform_regex}
 
 
+    @property
+    def checksums_url(self):
+        """Return the URL of the checksums file of the build"""
+
+        # firefox-13.0a1.en-US.win32.installer.exe => firefox-13.0a1.en-US.win32.checksums
+        name = re.sub(r'(\.installer)?(\.tar\.bz2|\.dmg|\.exe)$', '.checksums',
+                      self.binary)
+        return '/'.join([self.path, name])
+
+
     def build_filename(self, binary):
         """Return the proposed filename with extension for the binary"""
 
@@ -382,12 +1006,97 @@ class DailyScraper(MozillaScraper):
                                     self.base_url + self.monthly_build_list_regex)
 
 
+def iter_daily_builds(start, end, **kwargs):
+    """Yield a DailyScraper for each daily build between the start and end
+       date (%Y-%m-%d, both included) in chronological order.
+
+       The listing of each month is retrieved once and shared by the builds
+       of all its days. Further arguments are passed to DailyScraper. Each
+       scraper is created only when the generator gets advanced, so the
+       caller can stop early without retrieving unneeded listings."""
+
+    day = datetime.strptime(start, '%Y-%m-%d')
+    end = datetime.strptime(end, '%Y-%m-%d')
+
+    # The version is not used to find daily builds
+    kwargs.setdefault('version', None)
+
+    month = None
+    monthly_builds = None
+    while day <= end:
+        if month != (day.year, day.month):
+            month = (day.year, day.month)
+            url = '/'.join([BASE_URL, kwargs.get('application', 'firefox'),
+                            'nightly', day.strftime('%Y/%m/')])
+            print 'Retrieving list of builds from %s' % url
+            try:
+                monthly_builds = DirectoryParser(url).entries
+            except NotFoundException:
+                monthly_builds = [ ]
+
+        kwargs.update({'date': day.strftime('%Y-%m-%d'),
+                       'monthly_builds': monthly_builds})
+        try:
+            build = DailyScraper(build_number=1, **kwargs)
+        except NotFoundException, e:
+            print str(e)
+            build = None
+
+        if build is not None:
+            yield build
+            for build_number in range(2, len(build.builds) + 1):
+                yield DailyScraper(build_number=build_number, **kwargs)
+
+        day += timedelta(days=1)
+
+
 class ReleaseScraper(MozillaScraper):
     """Class to download a release build from the Mozilla server"""
 
     def __init__(self, *args, **kwargs):
         MozillaScraper.__init__(self, *args, **kwargs)
 
+    @property
+    def binary(self):
+        """Return the name of the build. The name is predicted from the naming
+           scheme of releases and confirmed via a HEAD request, unless the
+           listing of the folder is already known. Only if the prediction
+           misses or the request fails the listing gets retrieved."""
+
+        if self._binary is not None or self.path in missing_paths or \
+           shared_listings.lookup(self.path) is not None:
+            return MozillaScraper.binary.fget(self)
+
+        try:
+            url = '/'.join([self.path, self.predicted_binary])
+            http_pool.urlopen(url, method='HEAD').read()
+            self._binary = self.predicted_binary
+            self.record_prediction('hits')
+            return self._binary
+        except http_pool.HTTPError, e:
+            missed = e.code == 404
+        except (httplib.HTTPException, socket.error), e:
+            print 'Predicted build name could not be checked: %s' % str(e)
+            missed = False
+
+        # A missing folder raises here, so only a build with another name
+        # than the predicted one counts as a miss
+        binary = MozillaScraper.binary.fget(self)
+        if missed:
+            self.record_prediction('misses')
+        return binary
+
+
+    def record_prediction(self, key):
+        """Count a hit or a miss of the predicted build name"""
+
+        _prediction_lock.acquire()
+        try:
+            prediction_stats[key] += 1
+        finally:
+            _prediction_lock.release()
+
+
     @property
     def binary_regex(self):
         """Return the regex for the binary"""
@@ -401,6 +1110,37 @@ class ReleaseScraper(MozillaScraper):
         return regex[self.platform] % self.application
 
 
+    @property
+    def checksums_key(self):
+        """Return the filename of the build in the checksums file"""
+
+        return '/'.join([self.platform_regex, self.locale,
+                         urllib.unquote(self.binary)])
+
+
+    @property
+    def checksums_url(self):
+        """Return the URL of the checksums file of the build"""
+
+        return '/'.join([self.base_url, 'releases', self.version, 'SHA512SUMS'])
+
+
+    @property
+    def predicted_binary(self):
+        """Return the expected name of the build"""
+
+        template = {'linux': '%(APP)s-%(VERSION)s.tar.bz2',
+                    'linux64': '%(APP)s-%(VERSION)s.tar.bz2',
+                    'mac': '%(NAME)s %(VERSION)s.dmg',
+                    'mac64': '%(NAME)s %(VERSION)s.dmg',
+                    'win32': '%(NAME)s Setup %(VERSION)s.exe',
+                    'win64': '%(NAME)s Setup %(VERSION)s.exe'}
+        return urllib.quote(template[self.platform] % {
+                                'APP': self.application,
+                                'NAME': self.application.capitalize(),
+                                'VERSION': self.version})
+
+
     @property
     def path_regex(self):
         """Return the regex for the path"""
@@ -466,6 +1206,22 @@ class ReleaseCandidateScraper(ReleaseScraper):
                  'VERSION': self.version }
 
 
+    @property
+    def checksums_key(self):
+        """Return the filename of the build in the checksums file"""
+
+        key = ReleaseScraper.checksums_key.fget(self)
+        return 'unsigned/' + key if self.unsigned else key
+
+
+    @property
+    def checksums_url(self):
+        """Return the URL of the checksums file of the build"""
+
+        return '/'.join([self.base_url, self.candidate_build_list_regex +
+                         self.builds[self.build_index], 'SHA512SUMS'])
+
+
     @property
     def path_regex(self):
         """Return the regex for the path"""
@@ -490,23 +1246,55 @@ class ReleaseCandidateScraper(ReleaseScraper):
                            'EXT': self.extension}
 
 
-    def download(self):
+    def download(self, sink=None):
         """Download the specified file"""
 
+        self.resolve()
+        MozillaScraper.download(self, sink)
+
+
+    def check_platform_folder(self):
+        """Remember the platform folder of the build as missing if it is not
+           part of the build folder. The listing of the build folder is
+           shared, so it is only retrieved once for all locales."""
+
+        url = '/'.join([self.base_url, self.candidate_build_list_regex +
+                        self.builds[self.build_index]])
+        if self.unsigned:
+            url += '/unsigned'
+
+        folder = '/'.join([url, self.platform_regex])
+        if folder in missing_paths:
+            return
+
         try:
-            # Try to download the signed candidate build
-            MozillaScraper.download(self)
+            entries = DirectoryParser(url).entries
+        except NotFoundException:
+            # The build folder has been remembered as missing
+            return
+
+        if self.platform_regex not in entries:
+            missing_paths.add(folder)
+
+
+    def resolve(self):
+        """Resolve the signed build, or the unsigned build if the signed one
+           cannot be found and unsigned builds are allowed."""
+
+        self.check_platform_folder()
+        if self.no_unsigned or self.unsigned:
+            return MozillaScraper.resolve(self)
+
+        try:
+            # Try to use the signed candidate build
+            return MozillaScraper.resolve(self)
         except NotFoundException, e:
             print str(e)
 
-            # If the signed build cannot be downloaded and unsigned builds are
-            # allowed, try to download the unsigned build instead
-            if self.no_unsigned:
-                raise
-            else:
-                print "Signed build has not been found. Falling back to unsigned build."
-                self.unsigned = True
-                MozillaScraper.download(self)
+            print "Signed build has not been found. Falling back to unsigned build."
+            self.unsigned = True
+            self.check_platform_folder()
+            return MozillaScraper.resolve(self)
 
 
 class TinderboxScraper(MozillaScraper):
@@ -575,6 +1363,23 @@ class TinderboxScraper(MozillaScraper):
                         'LOCALE': self.locale}
 
 
+    def builds_for_date(self, timestamps, date):
+        """Return the build timestamps of the given day in ascending order.
+
+        Instead of converting each timestamp into a date of the Pacific time
+        zone, the timestamps are sorted as integers and the range of the day
+        is looked up via binary search."""
+
+        index = sorted([(int(timestamp), timestamp) for timestamp in timestamps])
+        keys = [key for (key, timestamp) in index]
+
+        day = datetime(date.year, date.month, date.day)
+        start = bisect.bisect_left(keys, self.epoch(day))
+        end = bisect.bisect_left(keys, self.epoch(day + timedelta(days=1)))
+
+        return [timestamp for (key, timestamp) in index[start:end]]
+
+
     def build_filename(self, binary):
         """Return the proposed filename with extension for the binary"""
 
@@ -610,6 +1415,13 @@ class TinderboxScraper(MozillaScraper):
         return False
 
 
+    def epoch(self, date):
+        """Return the UNIX timestamp of the given date in the Pacific time zone"""
+
+        date = date.replace(tzinfo=self.timezone)
+        return calendar.timegm((date - date.utcoffset()).timetuple())
+
+
     @property
     def date_validation_regex(self):
         """Return the regex for a valid date argument value"""
@@ -643,7 +1455,7 @@ class TinderboxScraper(MozillaScraper):
 
         # If date is given, retrieve the subset of builds on that date
         if self.date is not None:
-            parser.entries = filter(self.date_matches, parser.entries)
+            parser.entries = self.builds_for_date(parser.entries, self.date)
 
         if not parser.entries:
             message = 'No builds have been found'
@@ -685,6 +1497,11 @@ class PacificTimezone(tzinfo):
     for daylight saving.
     """
 
+    def __init__(self):
+        # Transition dates of daylight saving keyed by year
+        self._transitions = { }
+
+
     def utcoffset(self, dt):
         return timedelta(hours=-8) + self.dst(dt)
 
@@ -694,11 +1511,7 @@ class PacificTimezone(tzinfo):
 
 
     def dst(self, dt):
-        # Daylight saving starts on the second Sunday of March at 2AM standard
-        dst_start_date = self.first_sunday(dt.year, 3) + timedelta(days=7) \
-                                                       + timedelta(hours=2)
-        # Daylight saving ends on the first Sunday of November at 2AM standard
-        dst_end_date = self.first_sunday(dt.year, 11) + timedelta(hours=2)
+        (dst_start_date, dst_end_date) = self.dst_transitions(dt.year)
 
         if dst_start_date <= dt.replace(tzinfo=None) < dst_end_date:
             return timedelta(hours=1)
@@ -706,6 +1519,21 @@ class PacificTimezone(tzinfo):
             return timedelta(0)
 
 
+    def dst_transitions(self, year):
+        """Return the start and end date of daylight saving in the given year"""
+
+        if year not in self._transitions:
+            # Daylight saving starts on the second Sunday of March at 2AM standard
+            dst_start_date = self.first_sunday(year, 3) + timedelta(days=7) \
+                                                        + timedelta(hours=2)
+            # Daylight saving ends on the first Sunday of November at 2AM standard
+            dst_end_date = self.first_sunday(year, 11) + timedelta(hours=2)
+
+            self._transitions[year] = (dst_start_date, dst_end_date)
+
+        return self._transitions[year]
+
+
     def first_sunday(self, year, month):
         date = datetime(year, month, 1, 0)
         days_until_sunday = 6 - date.weekday()
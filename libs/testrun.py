@@ -49,11 +49,16 @@ import urllib
 import zipfile
 
 import application
+import build_cache
 import install
+import install_cache
+import install_pool
 import mozmill
 import rdf_parser
+import regression
 import report
 import repository
+import scraper
 
 
 MOZMILL_TESTS_REPOSITORIES = {
@@ -81,6 +86,9 @@ class TestFailedException(Exception):
 class TestRun(object):
     """ Class to execute a Mozmill test-run. """
 
+    # Installations from the install cache may share files with the cache
+    install_cache_hardlinks = True
+
     parser_options = {("-a", "--addons",): dict(dest="addons",
                                                 action="append",
                                                 default=None,
@@ -92,6 +100,21 @@ class TestRun(object):
                                                metavar="APP",
                                                default="firefox",
                                                help="Application Name, i.e. firefox, thunderbird"),
+                      ("--install-cache",): dict(dest="install_cache",
+                                                 default=None,
+                                                 metavar="PATH",
+                                                 help="Directory of a cache for installed builds"),
+                      ("--install-cache-size",): dict(dest="install_cache_size",
+                                                      default=install_cache.DEFAULT_MAX_SIZE / 1024 / 1024,
+                                                      type="int",
+                                                      metavar="MEGABYTES",
+                                                      help="Maximum size of the install cache, default: %d MB" %
+                                                           (install_cache.DEFAULT_MAX_SIZE / 1024 / 1024)),
+                      ("--install-pool-depth",): dict(dest="install_pool_depth",
+                                                      default=0,
+                                                      type="int",
+                                                      metavar="DEPTH",
+                                                      help="Number of upcoming builds to install in the background"),
                       ("--junit",): dict(dest="junit_file",
                                          default=None,
                                          metavar="PATH",
@@ -157,6 +180,11 @@ class TestRun(object):
         self.last_failed_tests = None
         self.last_exception = None
 
+        self._install_pool = None
+
+        # Delete installations which have been left over by a crash
+        install.reaper.start()
+
     def _generate_custom_report(self):
         if self.options.junit_file:
             filename = self._get_unique_filename(self.options.junit_file)
@@ -276,12 +304,27 @@ class TestRun(object):
             else:
                 self.addon_list.append(addon)
 
+    def install_binary(self, binary):
+        """ Install the binary into a temporary folder and return the folder
+            of the installation. """
+
+        install_path = tempfile.mkdtemp(".binary")
+        if self.options.install_cache:
+            cache = install_cache.InstallCache(self.options.install_cache,
+                                               self.options.install_cache_size * 1024 * 1024,
+                                               hardlinks=self.install_cache_hardlinks)
+            return cache.install(binary, install_path)
+        else:
+            return install.Installer().install(binary, install_path)
+
     def prepare_binary(self, binary):
         """ Prepare the binary for the test run. """
 
         if application.is_installer(self.options.application, binary):
-            install_path = tempfile.mkdtemp(".binary")
-            self._folder = install.Installer().install(binary, install_path)
+            if self._install_pool:
+                self._folder = self._install_pool.take(binary)
+            else:
+                self._folder = self.install_binary(binary)
             self._application = application.get_binary(self.options.application, self._folder)
         else:
             folder = os.path.dirname(binary)
@@ -380,6 +423,14 @@ class TestRun(object):
         if self.options.addons:
             self.prepare_addons()
 
+        if self.options.install_pool_depth > 0:
+            installers = [binary for binary in self.binaries
+                          if application.is_installer(self.options.application,
+                                                      binary)]
+            self._install_pool = install_pool.InstallPool(installers,
+                                                          self.install_binary,
+                                                          self.options.install_pool_depth)
+
         try:
             # Run tests for each binary
             for binary in self.binaries:
@@ -396,6 +447,12 @@ class TestRun(object):
                     self.cleanup_binary(binary)
 
         finally:
+            if self._install_pool:
+                self._install_pool.close()
+                print "*** Install pool: %(hits)d hits, %(misses)d misses, " \
+                      "%(wait_time).1fs waited" % self._install_pool.stats
+                self._install_pool = None
+
             self.remove_downloaded_addons()
             self.cleanup_repository()
 
@@ -552,6 +609,121 @@ class AddonsTestRun(TestRun):
         return report
 
 
+class BisectTestRun(TestRun):
+    """ Class to find the first daily build which fails a test """
+
+    # Reports of single bisection steps must not be mixed with functional runs
+    report_type = "firefox-bisect"
+    report_version = "1.0"
+
+    parser_options = copy.copy(TestRun.parser_options)
+    parser_options[("--bad",)] = dict(dest="bad",
+                                      metavar="DATE",
+                                      help="Date of a daily build which fails the test (%Y-%m-%d)")
+    parser_options[("--base-url",)] = dict(dest="base_url",
+                                           default=scraper.BASE_URL,
+                                           metavar="URL",
+                                           help="Base URL of the build server, can be a file:// URL "
+                                                "of a local mirror, default: %s" % scraper.BASE_URL)
+    parser_options[("--branch",)] = dict(dest="branch",
+                                         default="mozilla-central",
+                                         metavar="BRANCH",
+                                         help="Branch of the daily builds, default: mozilla-central")
+    parser_options[("--build-cache",)] = dict(dest="build_cache",
+                                              default=None,
+                                              metavar="DIRECTORY",
+                                              help="Directory of the build cache shared by all scripts")
+    parser_options[("--directory",)] = dict(dest="directory",
+                                            default="bisect",
+                                            metavar="DIRECTORY",
+                                            help="Target directory for the downloaded builds, default: bisect")
+    parser_options[("--good",)] = dict(dest="good",
+                                       metavar="DATE",
+                                       help="Date of a daily build which passes the test (%Y-%m-%d)")
+    parser_options[("--locale",)] = dict(dest="locale",
+                                         default="en-US",
+                                         metavar="LOCALE",
+                                         help="Locale of the daily builds, default: en-US")
+    parser_options[("--platform",)] = dict(dest="platform",
+                                           default=None,
+                                           metavar="PLATFORM",
+                                           help="Platform of the daily builds, default: current platform")
+    parser_options[("--restart",)] = dict(dest="restart_tests",
+                                          action="store_true",
+                                          default=False,
+                                          help="The test is a restart test")
+    parser_options[("--results",)] = dict(dest="results_file",
+                                          default=None,
+                                          metavar="PATH",
+                                          help="JSON file to keep the results of tested builds in")
+    parser_options[("--test",)] = dict(dest="test",
+                                       default=os.path.join("tests", "functional"),
+                                       metavar="PATH",
+                                       help="Test or folder of tests inside the mozmill-tests repository")
+
+
+    def __init__(self, *args, **kwargs):
+        TestRun.__init__(self, *args, **kwargs)
+
+        self.restart_tests = self.options.restart_tests
+        self.test_path = self.options.test
+
+    def run(self):
+        """ Bisect the daily builds between the good and the bad date. """
+
+        if not self.options.good or not self.options.bad:
+            print "*** The dates of a good and a bad build have to be specified. Use --help to see all options."
+            return
+
+        scraper.BASE_URL = self.options.base_url.rstrip('/')
+        if self.options.build_cache:
+            scraper.build_cache = build_cache.BuildCache(self.options.build_cache)
+
+        builds = scraper.iter_daily_builds(self.options.good, self.options.bad,
+                                           application=self.options.application,
+                                           branch=self.options.branch,
+                                           directory=self.options.directory,
+                                           locale=self.options.locale,
+                                           platform=self.options.platform)
+        finder = regression.RegressionFinder(builds, self.test_build,
+                                             self.options.results_file)
+
+        self.clone_repository()
+        try:
+            (good, bad) = finder.find()
+        finally:
+            self.cleanup_repository()
+
+        print "\nResults:\n========"
+        print "Last good build: %s" % good.final_url
+        print "First bad build: %s" % bad.final_url
+        for index in sorted(finder.skipped):
+            if finder.builds.index(good) < index < finder.builds.index(bad):
+                print "Untested build: %s" % finder.builds[index].path
+
+    def test_build(self, build):
+        """ Download the build, run the test, and return if it passes. Returns
+            None if the build cannot be downloaded or installed. """
+
+        try:
+            build.download()
+            self.binaries = [build.target]
+            self.prepare_binary(build.target)
+        except Exception, e:
+            print "*** Skipping build which cannot be installed: %s" % str(e)
+            return None
+
+        try:
+            self.prepare_repository()
+            TestRun.run_tests(self)
+            if self.options.report_url:
+                self.send_report(self.options.report_url)
+
+            return not self._mozmill.mozmill.fails
+        finally:
+            self.cleanup_binary(build.target)
+
+
 class EnduranceTestRun(TestRun):
     """ Class to execute a Firefox endurance test-run """
 
@@ -751,6 +923,9 @@ class UpdateTestRun(TestRun):
     report_type = "firefox-update"
     report_version = "1.0"
 
+    # The updater modifies the files of the installation
+    install_cache_hardlinks = False
+
     parser_options = copy.copy(TestRun.parser_options)
     parser_options[("--channel",)] = dict(dest="channel",
                                           choices=application.UPDATE_CHANNELS,
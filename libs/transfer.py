@@ -0,0 +1,561 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Module to transfer files via HTTP with several concurrent connections."""
+
+
+import hashlib
+import httplib
+import os
+import re
+import socket
+import threading
+import time
+
+import http_pool
+from json_file import JSONFile
+import metrics
+
+
+# Number of connections used for a single download
+DEFAULT_SEGMENTS = 4
+
+# Files smaller than that size per segment are not worth to be split up
+MIN_SEGMENT_SIZE = 1024 * 1024
+
+CHUNK_SIZE = 64 * 1024
+
+# Minimum number of seconds between updates of the resume information
+RESUME_SAVE_INTERVAL = 1
+
+# A segment switches to another mirror if less bytes per second than the
+# minimum throughput have been received during the window (in seconds)
+FAILOVER_MIN_THROUGHPUT = 16 * 1024
+FAILOVER_WINDOW = 10
+
+
+class TransferError(Exception):
+    """Exception for a failed or incomplete transfer"""
+    def __init__(self, message, url):
+        self.url = url
+        Exception.__init__(self, ': '.join([message, url]))
+
+
+class StalledTransferError(TransferError):
+    """Exception for a transfer which is too slow while other sources of the
+    file are available"""
+
+
+# Errors caused by the source of a transfer, which may be avoided by switching
+# to a mirror. Local errors like a full disk or a failing sink are not.
+SOURCE_ERRORS = (http_pool.HTTPError, httplib.HTTPException, socket.error,
+                 TransferError)
+
+
+class Segment(object):
+    """Class for a byte range of the file to download"""
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.position = start
+
+
+    @property
+    def complete(self):
+        """Return if all bytes of the segment have been written"""
+
+        return self.end is not None and self.position > self.end
+
+
+    @property
+    def range_header(self):
+        """Return the value of the HTTP Range header for the missing bytes"""
+
+        return 'bytes=%d-%d' % (self.position, self.end)
+
+
+class SegmentedDownload(object):
+    """Class to download a file via HTTP Range requests.
+
+    The file is split into segments which are fetched on their own connections
+    and written at their offset into the preallocated target file. If the
+    server does not support Range requests, or the file is too small to be
+    split up, the file is downloaded with a single connection.
+
+    The progress of each segment is stored in a sidecar file next to the
+    target. If a download gets interrupted the next attempt resumes all
+    segments as long as the validators (ETag, Last-Modified) of the remote
+    file have not been changed.
+
+    Digests of the given hash algorithms are computed while the data arrives.
+    Bytes written at the end of the contiguous hashed prefix are hashed right
+    away, and bytes of later segments are read back once the prefix reaches
+    them, so the file doesn't have to be read again after the download.
+
+    A sink, i.e. an object with a write() method, gets the content of the
+    file in order via the same mechanism while it is being downloaded. To
+    pass on the data as it arrives instead of after the first segment, a
+    download with a sink uses a single segment and fetches the segments of
+    a resumed download one after the other.
+
+    With a list of mirrors the probe is raced across the best ranked mirrors
+    and the fastest one becomes the source of all segments. A segment whose
+    transfer fails or stalls continues from another mirror.
+    """
+
+    def __init__(self, url, target, segments=DEFAULT_SEGMENTS,
+                 min_segment_size=MIN_SEGMENT_SIZE, algorithms=None,
+                 mirrors=None, sink=None):
+        self.url = url
+        self.mirrors = mirrors
+        self.sink = sink
+        self.source = url
+        self.target = target
+        self.max_segments = 1 if sink is not None else max(1, int(segments))
+        self.min_segment_size = min_segment_size
+        self.algorithms = algorithms or [ ]
+
+        self.length = None
+        self.accept_ranges = False
+        self.etag = None
+        self.last_modified = None
+        self.segments = [ ]
+
+        self.resume_file = JSONFile(target + '.json')
+
+        self._errors = [ ]
+        self._failed_sources = set()
+        self._lock = threading.Lock()
+        self._last_save = 0
+
+        self._digests = { }
+        self._digest_lock = threading.Lock()
+        self._hashed = 0
+
+
+    @property
+    def resumable(self):
+        """Return if the partially downloaded target can be resumed later"""
+
+        return os.path.isfile(self.resume_file.filename) and \
+               os.path.isfile(self.target)
+
+
+    @property
+    def validator(self):
+        """Return the value for the If-Range header of segment requests"""
+
+        return self.etag or self.last_modified
+
+
+    def download(self):
+        """Download the file into the target"""
+
+        start = time.time()
+        response = self.probe()
+        try:
+            self.segments = self.load_segments()
+
+            if self.segments:
+                print 'Resuming download of %d bytes' % self.remaining
+            else:
+                self.segments = self.split()
+
+                # Preallocate the target so each segment can be written at
+                # its offset
+                f = open(self.target, 'wb')
+                try:
+                    if self.length:
+                        f.truncate(self.length)
+                finally:
+                    f.close()
+
+                self.save_segments(True)
+
+            initial_size = self.completed
+
+            self._digests = dict([(algorithm, hashlib.new(algorithm))
+                                  for algorithm in self.algorithms])
+            self._hashed = 0
+            self.update_digests()
+
+            if response is not None:
+                # The server sent the whole file already with the probe
+                self.fetch_segment(self.segments[0], response)
+                response = None
+            elif len(self.segments) == 1 or self.sink is not None:
+                for segment in self.segments:
+                    self.fetch_segment(segment)
+                    if self._errors:
+                        break
+            else:
+                threads = [ ]
+                for segment in self.segments:
+                    thread = threading.Thread(target=self.fetch_segment,
+                                              args=(segment, ))
+                    thread.daemon = True
+                    thread.start()
+                    threads.append(thread)
+
+                for thread in threads:
+                    while thread.is_alive():
+                        thread.join(1)
+
+            if self._errors:
+                raise self._errors[0]
+
+            for segment in self.segments:
+                if not segment.complete and segment.end is not None:
+                    raise TransferError('Download is incomplete', self.url)
+
+            self.update_digests()
+        except:
+            self.save_segments(True)
+            raise
+        finally:
+            if response is not None:
+                response.close()
+
+        self.remove_resume_file()
+
+        duration = time.time() - start
+        size = self.completed - initial_size
+        metrics.record('transfer', self.url, duration, bytes=size,
+                       bytes_per_second=size / duration if duration else None,
+                       resumed=initial_size > 0, segments=len(self.segments),
+                       source=self.source)
+
+
+    @property
+    def completed(self):
+        """Return the number of bytes which have been written"""
+
+        return sum([segment.position - segment.start
+                    for segment in self.segments])
+
+
+    def alternatives(self, source):
+        """Return the sources of the file other than the given one which have
+           not failed yet"""
+
+        if self.mirrors is None or not self.accept_ranges:
+            return [ ]
+
+        self._lock.acquire()
+        try:
+            return [url for url in self.mirrors.urls(self.url)
+                    if url != source and url not in self._failed_sources]
+        finally:
+            self._lock.release()
+
+
+    def failover(self, source, error):
+        """Return another mirror to continue a segment which failed to be
+           transferred from the source. If there is none the error is raised.
+           A source which is only slow is not excluded from later attempts."""
+
+        if self.mirrors is None or not self.accept_ranges:
+            raise error
+
+        if not isinstance(error, StalledTransferError):
+            self._lock.acquire()
+            try:
+                self._failed_sources.add(source)
+            finally:
+                self._lock.release()
+            self.mirrors.record_failure(source)
+
+        sources = self.alternatives(source)
+        if not sources:
+            raise error
+
+        print 'Transfer from %s failed (%s), switching to %s' % \
+              (source, str(error), sources[0])
+        return sources[0]
+
+
+    def fetch_segment(self, segment, response=None):
+        """Download the missing bytes of a segment and write them to the
+           target file. Errors are stored to be raised by download()."""
+
+        try:
+            source = self.source
+            while True:
+                try:
+                    self.fetch_range(segment, source, response)
+                    break
+                except SOURCE_ERRORS, e:
+                    response = None
+                    source = self.failover(source, e)
+
+            # Catch up with data of following segments written in the meantime
+            self.update_digests()
+        except Exception, e:
+            self._lock.acquire()
+            try:
+                self._errors.append(e)
+            finally:
+                self._lock.release()
+
+
+    def fetch_range(self, segment, source, response=None):
+        """Download the missing bytes of a segment from the given source"""
+
+        if response is None:
+            headers = { }
+            if segment.end is not None:
+                headers['Range'] = segment.range_header
+                if self.validator and source == self.source:
+                    # Don't mix up content if the remote file has changed.
+                    # Validators differ between mirrors, so other mirrors
+                    # rely on the length and the checksums.
+                    headers['If-Range'] = self.validator
+            response = http_pool.urlopen(source, headers)
+
+            if segment.end is not None:
+                if response.getcode() != 206:
+                    response.close()
+                    raise TransferError('Server ignored the Range request',
+                                        source)
+
+                content_range = response.getheader('Content-Range', '')
+                if not content_range.endswith('/%d' % self.length):
+                    response.close()
+                    raise TransferError('Length of the file differs', source)
+
+        start = time.time()
+        size = 0
+        window_start = start
+        window_size = 0
+
+        # Unbuffered, so the stored progress never exceeds the written data
+        f = open(self.target, 'r+b', 0)
+        try:
+            f.seek(segment.position)
+            while not segment.complete:
+                chunk_size = CHUNK_SIZE
+                if segment.end is not None:
+                    chunk_size = min(chunk_size, segment.end - segment.position + 1)
+
+                data = response.read(chunk_size)
+                if not data:
+                    break
+
+                f.write(data)
+                self.hash_data(segment.position, data)
+                segment.position += len(data)
+                self.save_segments()
+
+                size += len(data)
+                window_size += len(data)
+                elapsed = time.time() - window_start
+                if self.mirrors is not None and elapsed >= FAILOVER_WINDOW:
+                    # Keep reading a slow source if there is no other one
+                    if window_size / elapsed < FAILOVER_MIN_THROUGHPUT and \
+                       not segment.complete and self.alternatives(source):
+                        raise StalledTransferError('Throughput collapsed',
+                                                   source)
+                    window_start = time.time()
+                    window_size = 0
+        finally:
+            f.close()
+            response.close()
+
+            if self.mirrors is not None:
+                self.mirrors.record_transfer(source, size, time.time() - start)
+
+
+    def consume(self, data):
+        """Pass the data which continues the hashed prefix to the digests and
+           the sink. The digest lock has to be held."""
+
+        for digest in self._digests.values():
+            digest.update(data)
+        if self.sink is not None:
+            self.sink.write(data)
+        self._hashed += len(data)
+
+
+    def hash_data(self, offset, data):
+        """Update the digests if the data continues the hashed prefix"""
+
+        if not self._digests and self.sink is None:
+            return
+
+        # Only the segment at the end of the prefix has to wait for the lock,
+        # e.g. while a slow sink consumes the previous data
+        if offset != self._hashed:
+            return
+
+        self._digest_lock.acquire()
+        try:
+            if offset == self._hashed:
+                self.consume(data)
+        finally:
+            self._digest_lock.release()
+
+
+    def hexdigests(self):
+        """Return the hex digests of the downloaded file keyed by algorithm"""
+
+        return dict([(algorithm, digest.hexdigest())
+                     for (algorithm, digest) in self._digests.items()])
+
+
+    def load_segments(self):
+        """Return the segments of a previously interrupted download if it can
+           be resumed, otherwise an empty list."""
+
+        if not self.accept_ranges or not self.resumable:
+            self.remove_resume_file()
+            return [ ]
+
+        try:
+            data = self.resume_file.read()
+            if data['url'] != self.url or \
+               data['length'] != self.length or \
+               data['etag'] != self.etag or \
+               data['last_modified'] != self.last_modified or \
+               os.path.getsize(self.target) != self.length:
+                raise ValueError('Remote file has been changed')
+
+            segments = [ ]
+            for (start, end, position) in data['segments']:
+                segment = Segment(start, end)
+                segment.position = position
+                segments.append(segment)
+            return segments
+        except Exception:
+            self.remove_resume_file()
+            return [ ]
+
+
+    @property
+    def remaining(self):
+        """Return the number of bytes which still have to be downloaded"""
+
+        return sum([segment.end - segment.position + 1
+                    for segment in self.segments if not segment.complete])
+
+
+    def remove_resume_file(self):
+        """Remove the resume information of the download"""
+
+        try:
+            os.remove(self.resume_file.filename)
+        except OSError:
+            pass
+
+
+    def save_segments(self, force=False):
+        """Store the progress of all segments so the download can be resumed.
+           Unless forced the data is written at most once per interval."""
+
+        # Without Range support a partial download cannot be resumed
+        if not self.accept_ranges or not self.length:
+            return
+
+        self._lock.acquire()
+        try:
+            if not force and time.time() - self._last_save < RESUME_SAVE_INTERVAL:
+                return
+
+            self.resume_file.write({'url': self.url,
+                                    'length': self.length,
+                                    'etag': self.etag,
+                                    'last_modified': self.last_modified,
+                                    'segments': [[segment.start,
+                                                  segment.end,
+                                                  segment.position]
+                                                 for segment in self.segments]})
+            self._last_save = time.time()
+        finally:
+            self._lock.release()
+
+
+    def probe(self):
+        """Retrieve the length of the file and check for Range support.
+
+        If the server does not support Range requests the response of the
+        probe already contains the whole file and gets returned so it can be
+        consumed instead of opening another connection.
+        """
+
+        headers = {'Range': 'bytes=0-0'}
+        if self.mirrors is not None:
+            (self.source, response) = self.mirrors.race(self.url, headers)
+            if self.source != self.url:
+                print 'Using mirror: %s' % self.source
+        else:
+            response = http_pool.urlopen(self.url, headers)
+
+        self.etag = response.getheader('ETag')
+        self.last_modified = response.getheader('Last-Modified')
+
+        content_range = response.getheader('Content-Range', '')
+        match = re.match(r'bytes\s+0-0/(\d+)', content_range)
+        if response.getcode() == 206 and match:
+            self.length = int(match.group(1))
+            self.accept_ranges = True
+            response.read()
+            return None
+
+        content_length = response.getheader('Content-Length')
+        if content_length is not None:
+            self.length = int(content_length)
+        return response
+
+
+    def split(self):
+        """Return the list of segments to download"""
+
+        if not self.accept_ranges:
+            # Without Range support the complete file has to be retrieved at once
+            return [Segment(0, self.length - 1 if self.length else None)]
+
+        if not self.length:
+            return [ ]
+
+        count = min(self.max_segments, self.length // self.min_segment_size)
+        count = max(1, count)
+        size = self.length // count
+
+        segments = [ ]
+        for index in range(count):
+            start = index * size
+            end = self.length - 1 if index == count - 1 else start + size - 1
+            segments.append(Segment(start, end))
+        return segments
+
+
+    def update_digests(self):
+        """Hash all data which has been written directly after the hashed
+           prefix, by reading it back from the target file."""
+
+        if not self._digests and self.sink is None:
+            return
+
+        self._digest_lock.acquire()
+        try:
+            f = open(self.target, 'rb')
+            try:
+                for segment in self.segments:
+                    if segment.end is not None and segment.end < self._hashed:
+                        continue
+
+                    f.seek(self._hashed)
+                    while self._hashed < segment.position:
+                        size = min(CHUNK_SIZE, segment.position - self._hashed)
+                        data = f.read(size)
+                        if not data:
+                            break
+                        self.consume(data)
+
+                    if not segment.complete:
+                        break
+            finally:
+                f.close()
+        finally:
+            self._digest_lock.release()
@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import sys
+
+from libs.regression import RegressionException
+from libs.testrun import *
+
+
+def main():
+    try:
+        BisectTestRun().run()
+    except RegressionException, e:
+        print str(e)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
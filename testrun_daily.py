@@ -55,6 +55,19 @@ def main():
                       dest="logfile",
                       metavar="PATH",
                       help="Path to the log file")
+    parser.add_option("--install-cache",
+                      default=None,
+                      dest="install_cache",
+                      metavar="PATH",
+                      help="Directory of a cache for installed builds, "
+                           "overrides the config file")
+    parser.add_option("--install-cache-size",
+                      default=None,
+                      dest="install_cache_size",
+                      type="int",
+                      metavar="MEGABYTES",
+                      help="Maximum size of the install cache, "
+                           "overrides the config file")
     (options, args) = parser.parse_args()
 
     if not args:
@@ -74,6 +87,20 @@ def main():
         if url:
             general_args.append('--report=%s' % url)
 
+        # Installers are cloned from the install cache if it is configured
+        if config.has_section('install_cache'):
+            if not options.install_cache and \
+               config.has_option('install_cache', 'directory'):
+                options.install_cache = config.get('install_cache', 'directory')
+            if options.install_cache_size is None and \
+               config.has_option('install_cache', 'size'):
+                options.install_cache_size = config.getint('install_cache', 'size')
+        if options.install_cache:
+            general_args.append('--install-cache=%s' % options.install_cache)
+            if options.install_cache_size is not None:
+                general_args.append('--install-cache-size=%d' %
+                                    options.install_cache_size)
+
         # Get the list of binaries for the current platform
         general_args.extend([binary for name, binary in config.items(sys.platform)])
     except Exception, e:
@@ -47,6 +47,8 @@ import shutil
 import sys
 import urllib
 
+from libs.matrix import add_options, create_matrix, print_results, \
+                        print_statistics, write_manifest
 from libs import scraper
 
 
@@ -82,6 +84,7 @@ def main():
 
     usage = 'usage: %prog [options]'
     parser = OptionParser(usage=usage, description=__doc__)
+    add_options(parser)
     parser.add_option('--clobber',
                       dest='clobber',
                       action="store_true",
@@ -119,6 +122,8 @@ def main():
                     'PREFIX': options.testrun['script']}
     initialize_directory(directory, options.clobber)
 
+    matrix = create_matrix(options)
+
     # Iterate through all OS
     for section in config.sections():
         # Retrieve the platform, i.e. win32 or linux64
@@ -150,9 +155,8 @@ def main():
             except:
                 continue
 
-            # Download each listed locale
+            # Queue up each listed locale for download
             for locale in locales:
-                # Instantiate scraper and download the build
                 scraper_keywords = {'application': options.testrun['application'],
                                     'locale': locale,
                                     'platform': platform,
@@ -162,9 +166,19 @@ def main():
 
                 kwargs = scraper_keywords.copy()
                 kwargs.update(scraper_options.get(build_type, {}))
-                build = BUILD_TYPES[build_type](**kwargs)
-
-                build.download()
+                matrix.add(BUILD_TYPES[build_type], **kwargs)
+
+    # Download or resolve all builds and report the result for each of them
+    if options.manifest:
+        results = matrix.resolve()
+        write_manifest(options.manifest, results)
+    else:
+        results = matrix.download()
+    print_results(results)
+    print_statistics()
+
+    if [result for result in results if result['status'] == 'failed']:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()